@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+import glob
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import snixLogger
+from engine import Call, Return, Spawn
+from snixCore import abort
+
+logger = snixLogger.SnixLogger.logger()
+
+BREW_PREFIXES = ['/usr/local', '/opt/homebrew', '/home/linuxbrew/.linuxbrew']
+
+
+def _sudo():
+    return [] if os.geteuid() == 0 else ['sudo']
+
+
+def parse_versions(out):
+    """Parses `name version...` lines into name -> version, keeping the last field as the version."""
+    versions = OrderedDict()
+    for line in out.splitlines():
+        fields = line.split()
+        if fields:
+            versions[fields[0]] = fields[-1] if len(fields) > 1 else ''
+    return versions
+
+
+def _kegs(directory):
+    """The brew directory and the one of every formula or cask in it. An upgrade adds a version under
+    <directory>/<name>, which leaves the mtime of the directory itself alone."""
+    paths = []
+    for prefix in BREW_PREFIXES:
+        root = os.path.join(prefix, directory)
+        paths.append(root)
+        paths.extend(sorted(glob.glob(os.path.join(root, '*'))))
+    return paths
+
+
+class Backend(object):
+    """Installs items for one `via`.
+    A backend says whether several names can be installed with one command and which lock domain its installs hold.
+    Installs in the same lock domain never run at the same time, e.g. because the package manager locks its database,
+    while different domains run in parallel. Subclasses provide the commands, or override the coroutines."""
+    via = None
+    lock = None
+    batches = True
+
+    def install_cmd(self, names):
+        raise NotImplementedError
+
+    def list_cmd(self, names):
+        """A command that prints what is installed, limited to names if the backend can do that."""
+        raise NotImplementedError
+
+    def explicit_cmd(self):
+        """A command that prints only what was installed on request, leaving out what came in as a dependency.
+        None if list_cmd already prints only that."""
+        return None
+
+    def parse_explicit(self, out):
+        """Reads the names out of explicit_cmd's output, one per line."""
+        return [line.split()[0] for line in out.splitlines() if line.strip()]
+
+    def parse(self, out):
+        return parse_versions(out)
+
+    def normalize(self, name):
+        """The key a name is listed under. Tap qualified names such as homebrew/versions/foo are listed as foo."""
+        return name.split('/')[-1].lower()
+
+    def state_paths(self, context):
+        """Files or directories whose mtime changes whenever something is installed or removed, so an unchanged
+        listing can be reused. Empty if there are none, in which case the backend is always listed."""
+        return []
+
+    def install(self, context, names):
+        """Coroutine that installs names and finishes with the status code."""
+        ret = yield Spawn(self.install_cmd(names))
+        raise Return(ret)
+
+    def list_installed(self, context, names=()):
+        """Coroutine that finishes with name -> version for what is installed. A listing exits non-zero when some
+        of the names are missing but still prints the ones that are there."""
+        ret, out = yield Spawn(self.list_cmd(names), capture=True)
+        if ret and not out.strip():
+            logger.warn("Could not list what is installed via {0}. Assuming nothing is.".format(self.via))
+        raise Return(self.parse(out))
+
+    def list_explicit(self, context):
+        """Coroutine that finishes with the names that were installed on request. Everything installed counts if the
+        backend can't tell them apart from dependencies."""
+        if self.explicit_cmd() is not None:
+            ret, out = yield Spawn(self.explicit_cmd(), capture=True)
+            if ret == 0:
+                raise Return(self.parse_explicit(out))
+            logger.warn("Could not tell what was installed on request via {0}. Counting everything.".format(self.via))
+        installed = yield self.list_installed(context, ())
+        raise Return(list(installed))
+
+
+class Brew(Backend):
+    via = 'brew'
+    lock = 'brew'
+
+    def install_cmd(self, names):
+        return ['brew', 'install'] + list(names)
+
+    def list_cmd(self, names):
+        return ['brew', 'list', '--versions'] + list(names)
+
+    def explicit_cmd(self):
+        return ['brew', 'leaves']
+
+    def state_paths(self, context):
+        return _kegs('Cellar')
+
+
+class BrewCask(Backend):
+    via = 'brew-cask'
+    lock = 'brew'
+
+    def install_cmd(self, names):
+        return ['brew', 'cask', 'install'] + list(names)
+
+    def list_cmd(self, names):
+        return ['brew', 'cask', 'list', '--versions'] + list(names)
+
+    def state_paths(self, context):
+        return _kegs('Caskroom')
+
+
+class Apt(Backend):
+    via = 'apt'
+    lock = 'dpkg'
+
+    def install_cmd(self, names):
+        return _sudo() + ['apt-get', 'install', '-y', '-q'] + list(names)
+
+    def list_cmd(self, names):
+        return ['dpkg-query', '-W', '-f', '${db:Status-Abbrev} ${Package} ${Version}\n'] + list(names)
+
+    def explicit_cmd(self):
+        return ['apt-mark', 'showmanual']
+
+    def state_paths(self, context):
+        return ['/var/lib/dpkg/status']
+
+    def parse(self, out):
+        # Only `ii` packages are installed. dpkg also knows about removed ones and the ones it has never installed.
+        return parse_versions('\n'.join(line[4:] for line in out.splitlines() if line.startswith('ii ')))
+
+
+class Dnf(Backend):
+    via = 'dnf'
+    lock = 'rpm'
+
+    def install_cmd(self, names):
+        return _sudo() + ['dnf', 'install', '-y', '-q'] + list(names)
+
+    def list_cmd(self, names):
+        return ['rpm', '-q' if names else '-qa', '--qf', '%{NAME} %{VERSION}-%{RELEASE}\n'] + list(names)
+
+    def explicit_cmd(self):
+        return ['dnf', 'repoquery', '--userinstalled', '--qf', '%{name}']
+
+    def state_paths(self, context):
+        return ['/var/lib/rpm']
+
+    def parse(self, out):
+        return parse_versions('\n'.join(line for line in out.splitlines() if not line.endswith(' is not installed')))
+
+
+class Pip(Backend):
+    via = 'pip'
+    lock = 'pip'
+
+    def install_cmd(self, names):
+        return ['pip', 'install', '--user'] + list(names)
+
+    def list_cmd(self, names):
+        return ['pip', 'list', '--format=freeze']
+
+    def explicit_cmd(self):
+        return ['pip', 'list', '--not-required', '--format=freeze']
+
+    def parse_explicit(self, out):
+        return list(self.parse(out))
+
+    def parse(self, out):
+        return parse_versions(out.replace('==', ' '))
+
+
+class Npm(Backend):
+    via = 'npm'
+    lock = 'npm'
+
+    def install_cmd(self, names):
+        return ['npm', 'install', '--global'] + list(names)
+
+    def list_cmd(self, names):
+        return ['npm', 'ls', '--global', '--depth=0', '--json']
+
+    def parse(self, out):
+        try:
+            dependencies = json.loads(out or '{}').get('dependencies', {})
+        except ValueError:
+            return {}
+        return dict((name, info.get('version', '')) for name, info in dependencies.items())
+
+
+class Url(Backend):
+    """Downloads the item, whose name is a URL, into <snix home>/downloads and installs it.
+    Disk images are mounted and their apps and packages installed, packages are installed, archives are extracted
+    into <snix home>/opt and any other file is put in <snix home>/bin. Installed URLs are remembered under
+    <snix home>/.cache/installed, since there is no package database to ask."""
+    via = 'url'
+    batches = False
+
+    @staticmethod
+    def _marker(context, url):
+        return os.path.join(context['snix_root'], '.cache', 'installed', hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _name(url):
+        return os.path.basename(url.split('?')[0].rstrip('/'))
+
+    def normalize(self, name):
+        # Different URLs often end in the same file name, so a URL is only ever the same item as itself.
+        return name
+
+    def install(self, context, names):
+        import download
+        ret = 0
+        for url in names:
+            # Downloaded under the hash of the marker, so URLs ending in the same file name don't overwrite each other.
+            target = os.path.join(context['snix_root'], 'downloads', os.path.basename(self._marker(context, url)),
+                                  self._name(url))
+            try:
+                yield Call(download.fetch, url, target)
+                cmds = yield Call(self._install_file, context, target)
+            except (EnvironmentError, ValueError) as e:
+                logger.error("Could not install {0}: {1}".format(url, e))
+                ret = 1
+                continue
+            status = 0
+            for cmd in cmds:
+                status = yield Spawn(cmd)
+                if status:
+                    break
+            if status:
+                ret = status
+                continue
+            yield Call(self._remember, context, url)
+        raise Return(ret)
+
+    def _install_file(self, context, target):
+        """Prepares target and returns the commands that install it."""
+        import extract
+        if target.endswith('.dmg'):
+            mount = target[:-len('.dmg')] + '.mount'
+            return [['hdiutil', 'attach', '-nobrowse', '-quiet', '-mountpoint', mount, target],
+                    ['sh', '-c', 'for app in "$0"/*.app; do [ -e "$app" ] && cp -R "$app" /Applications/; done; '
+                                 'for pkg in "$0"/*.pkg; do [ -e "$pkg" ] && sudo installer -pkg "$pkg" -target /; '
+                                 'done; hdiutil detach -quiet "$0"', mount]]
+        if target.endswith('.pkg'):
+            return [_sudo() + ['installer', '-pkg', target, '-target', '/']]
+        if extract.is_archive(target):
+            name = os.path.basename(target).split('.')[0]
+            location = extract.extract(target, os.path.join(context['snix_root'], 'opt', name))
+            return [['cp', '-R', app, '/Applications/'] for app in glob.glob(os.path.join(location, '*.app'))]
+        bin_dir = os.path.join(context['snix_root'], 'bin')
+        return [['mkdir', '-p', bin_dir], ['install', '-m', '755', target, os.path.join(bin_dir, self._name(target))]]
+
+    def _remember(self, context, url):
+        marker = self._marker(context, url)
+        if not os.path.isdir(os.path.dirname(marker)):
+            os.makedirs(os.path.dirname(marker))
+        with open(marker, 'w') as f:
+            f.write(url.encode('utf-8') + '\n')
+
+    def _installed(self, context, names):
+        if not names:
+            directory = os.path.dirname(self._marker(context, ''))
+            if not os.path.isdir(directory):
+                return {}
+            names = []
+            for marker in os.listdir(directory):
+                with open(os.path.join(directory, marker), 'r') as f:
+                    names.append(f.read().strip().decode('utf-8'))
+        return dict((url, 'url') for url in names if os.path.exists(self._marker(context, url)))
+
+    def state_paths(self, context):
+        return [os.path.dirname(self._marker(context, ''))]
+
+    def list_installed(self, context, names=()):
+        installed = yield Call(self._installed, context, names)
+        raise Return(installed)
+
+
+class Dmg(Url):
+    """The `dmg` via from older manifests. It's a URL install."""
+    via = 'dmg'
+
+
+_registry = OrderedDict()
+
+
+def register(backend):
+    """Makes a Backend instance available as its `via`."""
+    _registry[backend.via] = backend
+
+
+def get(via):
+    backend = _registry.get(via)
+    if backend is None:
+        abort("There is no backend for via {0}. Known backends are {1}.".format(via, ', '.join(_registry)))
+    return backend
+
+
+def vias():
+    return _registry.keys()
+
+
+for _backend in (Brew(), BrewCask(), Apt(), Dnf(), Pip(), Npm(), Url(), Dmg()):
+    register(_backend)
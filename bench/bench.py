@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""Benchmarks snix against synthetic manifests.
+
+The manifests have a configurable number of items, repos and scripts and an include tree of a given depth and fan-out.
+Local bare repos stand in for upstreams, and the fake brew and git in bench/bin simulate latency and failures.
+Context construction is measured cold (includes not fetched yet), warm (includes fetched) and cached. End-to-end
+`snix run` is measured for each executor. Every measurement runs in a fresh process, which reports its wall time and
+peak memory.
+
+    python bench/bench.py --items 400 --repos 20 --depth 2 --fanout 3 --json after.json --baseline before.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SNIX_DIR = os.path.dirname(BENCH_DIR)
+GROUPS_REPO = 'groups'
+
+
+def _git(*args, **kwargs):
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(('git',) + args, stdout=devnull, stderr=devnull, **kwargs)
+
+
+def _real_git():
+    for directory in os.environ['PATH'].split(os.pathsep):
+        candidate = os.path.join(directory, 'git')
+        if os.path.abspath(directory) != os.path.join(BENCH_DIR, 'bin') and os.access(candidate, os.X_OK):
+            return candidate
+    sys.exit("git is not on the PATH")
+
+
+def _commit(work_dir, bare_repo):
+    _git('init', '-q', cwd=work_dir)
+    _git('add', '.', cwd=work_dir)
+    _git('-c', 'user.email=bench@snix', '-c', 'user.name=bench', 'commit', '-qm', 'bench', cwd=work_dir)
+    _git('clone', '-q', '--bare', work_dir, bare_repo)
+
+
+class Workspace:
+    """A throwaway HOME with a snix.conf, the upstream bare repos and the manifests."""
+
+    def __init__(self, root, args):
+        self.root = root
+        self.args = args
+        self.home = os.path.join(root, 'home')
+        self.snix_home = os.path.join(root, 'lab')
+        self.upstream = os.path.join(root, 'upstream')
+        self.manifest = os.path.join(root, 'bench.snix')
+        self.state = os.path.join(root, 'brew-state')
+        self.nodes = 0
+
+    def env(self):
+        env = dict(os.environ)
+        env.update({'HOME': self.home,
+                    'PATH': os.path.join(BENCH_DIR, 'bin') + os.pathsep + os.environ['PATH'],
+                    'SNIX_BENCH_GIT': _real_git(),
+                    'SNIX_BENCH_STATE': self.state,
+                    'SNIX_BENCH_LATENCY': str(self.args.latency / 1000.0),
+                    'SNIX_BENCH_ITEM_LATENCY': str(self.args.item_latency / 1000.0)})
+        return env
+
+    def create(self):
+        conf_dir = os.path.join(self.home, '.snix')
+        os.makedirs(conf_dir)
+        with open(os.path.join(conf_dir, 'snix.conf'), 'w') as f:
+            f.write("[config]\nsnix.home = {0}\n".format(self.snix_home))
+        os.makedirs(self.upstream)
+        self._create_repos()
+        nodes = self._include_tree()
+        self.nodes = len(nodes)
+        manifests = dict((node, {}) for node in nodes)
+        self._distribute(manifests, nodes)
+        work_dir = os.path.join(self.root, 'groups-work')
+        for node in nodes[1:]:
+            os.makedirs(os.path.join(work_dir, node))
+            with open(os.path.join(work_dir, node, node + '.snix'), 'w') as f:
+                json.dump(manifests[node], f)
+        if len(nodes) > 1:
+            _commit(work_dir, self._repo_url(GROUPS_REPO))
+        with open(self.manifest, 'w') as f:
+            json.dump(manifests[nodes[0]], f)
+
+    def _repo_url(self, name):
+        return os.path.join(self.upstream, name + '.git')
+
+    def _repo_names(self):
+        broken = int(self.args.repos * self.args.fail_rate)
+        return ['repo%d' % i for i in range(self.args.repos - broken)] + ['broken%d' % i for i in range(broken)]
+
+    def _create_repos(self):
+        template = os.path.join(self.root, 'repo-work')
+        os.makedirs(os.path.join(template, 'scripts'))
+        setup = os.path.join(template, 'scripts', 'setup.sh')
+        with open(setup, 'w') as f:
+            f.write("#!/bin/sh\necho set up $(basename $(dirname $(pwd)))\n")
+        os.chmod(setup, 0o755)
+        _commit(template, self._repo_url('template'))
+        for name in self._repo_names():
+            if not name.startswith('broken'):
+                shutil.copytree(self._repo_url('template'), self._repo_url(name))
+
+    def _include_tree(self):
+        """Returns the node names breadth first, the root manifest first."""
+        nodes = ['root']
+        level = ['root']
+        for _ in range(self.args.depth):
+            level = ["{0}_{1}".format(parent, i) for parent in level for i in range(self.args.fanout)]
+            nodes.extend(level)
+        return nodes
+
+    def _distribute(self, manifests, nodes):
+        for node in nodes[1:]:
+            parent = node.rsplit('_', 1)[0]
+            manifests[parent].setdefault('includes', []).append(
+                {'upstreamRepo': self._repo_url(GROUPS_REPO), 'pathRelativeToGroupManifestDir': node})
+        broken = int(self.args.items * self.args.fail_rate)
+        names = ['pkg%d' % i for i in range(self.args.items - broken)] + ['broken-pkg%d' % i for i in range(broken)]
+        for i, name in enumerate(names):
+            via = 'brew-cask' if i % 5 == 4 else 'brew'
+            items = manifests[nodes[i % len(nodes)]].setdefault('items', [])
+            entry = [item for item in items if item['via'] == via]
+            if entry:
+                entry[0]['names'].append(name)
+            else:
+                items.append({'via': via, 'names': [name]})
+        for i, name in enumerate(self._repo_names()):
+            manifest = manifests[nodes[i % len(nodes)]]
+            manifest.setdefault('repos', []).append(self._repo_url(name))
+            if i < self.args.scripts:
+                manifest.setdefault('customScripts', []).append(name + '/scripts/setup.sh')
+
+    def reset(self, keep_includes=False):
+        """Removes everything snix created, optionally keeping the include repos it fetched."""
+        if os.path.exists(self.state):
+            os.remove(self.state)
+        if not os.path.isdir(self.snix_home):
+            return
+        for entry in os.listdir(self.snix_home):
+            if keep_includes and entry == GROUPS_REPO:
+                continue
+            if keep_includes and entry == '.cache':
+                shutil.rmtree(os.path.join(self.snix_home, entry, 'manifests'), ignore_errors=True)
+                continue
+            shutil.rmtree(os.path.join(self.snix_home, entry))
+
+
+def _measure(workspace, mode, extra):
+    """Runs one measurement in a fresh process and returns its result dict."""
+    fd, out = tempfile.mkstemp(dir=workspace.root, suffix='.json')
+    os.close(fd)
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', mode, workspace.manifest, out] + extra
+    with open(os.path.join(workspace.root, 'snix.log'), 'a') as log:
+        subprocess.call(cmd, cwd=SNIX_DIR, env=workspace.env(), stdout=log, stderr=log)
+    with open(out, 'r') as f:
+        return json.load(f)
+
+
+def _peak_memory_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+def _child(mode, manifest, out, extra):
+    """The measured process: builds the context or runs snix, then writes its wall time and peak memory to out."""
+    sys.path.insert(0, SNIX_DIR)
+    result = {'status': 0}
+    start = time.time()
+    try:
+        if mode == 'construct':
+            from snixContext import snixContext
+            context = snixContext.construct_from(manifest, 'cached' in extra, 4, False, 'stream' in extra)
+            # Iterating creates the items, repos and scripts one at a time, as the scheduler does.
+            result['entries'] = sum(1 for entries in (context.get_items(), context.get_repos(),
+                                                      context.get_custom_scripts(), context.get_downloads())
+                                    for _ in entries)
+        else:
+            import runpy
+            sys.argv = ['snix', 'run', manifest, '--no-cache'] + extra
+            runpy.run_path(os.path.join(SNIX_DIR, 'snix'), run_name='__main__')
+    except SystemExit as e:
+        result['status'] = e.code or 0
+    result['seconds'] = time.time() - start
+    result['peak_mb'] = _peak_memory_mb()
+    with open(out, 'w') as f:
+        json.dump(result, f)
+
+
+def _summarize(name, results, actions=None):
+    seconds = sorted(result['seconds'] for result in results)
+    summary = {'name': name, 'median': seconds[len(seconds) // 2], 'min': seconds[0],
+               'peak_mb': max(result['peak_mb'] for result in results),
+               'failed_runs': len([result for result in results if result['status']])}
+    if actions:
+        summary['actions_per_second'] = actions / summary['median']
+    return summary
+
+
+def _report(summaries, baseline):
+    previous = dict((summary['name'], summary) for summary in baseline or [])
+    print("{0:<28} {1:>10} {2:>10} {3:>9} {4:>10} {5:>8}".format(
+        'benchmark', 'median s', 'min s', 'peak MB', 'actions/s', 'vs base'))
+    for summary in summaries:
+        change = ''
+        if summary['name'] in previous:
+            change = "{0:+.1f}%".format(100.0 * (summary['median'] / previous[summary['name']]['median'] - 1))
+        print("{0:<28} {1:>10.3f} {2:>10.3f} {3:>9.1f} {4:>10} {5:>8}".format(
+            summary['name'], summary['median'], summary['min'], summary['peak_mb'],
+            "%.1f" % summary['actions_per_second'] if 'actions_per_second' in summary else '-', change))
+        if summary['failed_runs']:
+            print("  {0} run(s) exited with an error".format(summary['failed_runs']))
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return _child(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:])
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=200, help="Number of items across all manifests.")
+    parser.add_argument('--repos', type=int, default=10, help="Number of repos across all manifests.")
+    parser.add_argument('--scripts', type=int, default=5, help="Number of repos that also have a custom script.")
+    parser.add_argument('--depth', type=int, default=2, help="Depth of the include tree. 0 means no includes.")
+    parser.add_argument('--fanout', type=int, default=2, help="Number of includes in each manifest of the tree.")
+    parser.add_argument('--latency', type=float, default=50, help="Milliseconds each brew or git command takes.")
+    parser.add_argument('--item-latency', type=float, default=5, help="Additional milliseconds per brew formula.")
+    parser.add_argument('--fail-rate', type=float, default=0, help="Fraction of items and repos that fail.")
+    parser.add_argument('--jobs', type=int, default=4, help="The -j snix runs with.")
+    parser.add_argument('--executors', default='threads,engine',
+                        help="Comma separated executors to run with. Empty to only measure context construction.")
+    parser.add_argument('--stream-json', action='store_true',
+                        help="Also measure construction with incremental JSON parsing. Needs ijson.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of times each benchmark is run.")
+    parser.add_argument('--json', help="Write the results to this file.")
+    parser.add_argument('--baseline', help="Results of an earlier --json run to compare against.")
+    parser.add_argument('--keep', action='store_true', help="Keep the workspace and print where it is.")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='snix-bench-')
+    try:
+        workspace = Workspace(root, args)
+        workspace.create()
+        print("{0} items, {1} repos, {2} scripts in {3} manifests".format(
+            args.items, args.repos, min(args.scripts, args.repos), workspace.nodes))
+        actions = args.items + args.repos + min(args.scripts, args.repos)
+        summaries = []
+        cold = []
+        for _ in range(args.repeat):
+            workspace.reset()
+            cold.append(_measure(workspace, 'construct', []))
+        summaries.append(_summarize('construct (cold)', cold))
+        summaries.append(_summarize('construct (warm)', [
+            _measure(workspace, 'construct', []) for _ in range(args.repeat)]))
+        summaries.append(_summarize('construct (cached)', [
+            _measure(workspace, 'construct', ['cached']) for _ in range(args.repeat)]))
+        if args.stream_json:
+            summaries.append(_summarize('construct (warm, streamed)', [
+                _measure(workspace, 'construct', ['stream']) for _ in range(args.repeat)]))
+        for executor in filter(None, args.executors.split(',')):
+            runs = []
+            for _ in range(args.repeat):
+                workspace.reset(keep_includes=True)
+                runs.append(_measure(workspace, 'run', ['-j', str(args.jobs), '--executor', executor]))
+            summaries.append(_summarize('run -j{0} {1}'.format(args.jobs, executor), runs, actions))
+
+        baseline = None
+        if args.baseline:
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)['results']
+        _report(summaries, baseline)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'parameters': vars(args),
+                           'results': summaries}, f, indent=2)
+    finally:
+        if args.keep:
+            print("Workspace kept in " + root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
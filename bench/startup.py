@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Enforces the startup budget of the snix CLI.
+
+Each scenario runs snix in a fresh process and measures the time from the first import to exit, i.e. what snix adds on
+top of starting the interpreter, and the modules it loaded. It fails if the median time is over the budget or a
+module the action has no use for got imported.
+
+    python bench/startup.py --repeat 20 --scale 1.5
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SNIX_DIR = os.path.dirname(BENCH_DIR)
+
+HEAVY = ['jsonschema', 'urllib2', 'httplib', 'ssl', 'zipfile', 'tarfile']
+# name: (snix arguments, budget in ms, modules that must not be imported)
+SCENARIOS = [
+    ('help', ['--help'], 40, HEAVY + ['subprocess', 'engine', 'snixContext', 'ConfigParser']),
+    ('lint', ['lint', '{manifest}'], 120, ['subprocess', 'engine', 'snixContext', 'zipfile', 'tarfile']),
+    ('test (cached)', ['test', '{manifest}', '--no-probe'], 100, HEAVY),
+]
+MANIFEST = {'items': [{'via': 'brew', 'names': ['git', 'wget', 'jq']}, {'via': 'brew-cask', 'names': ['iterm2']}],
+            'repos': ['https://github.com/yaise/snix.git'],
+            'customScripts': ['snix/bootstrap.py']}
+
+
+# Runs in the measured process. It's passed with -c so that nothing but the interpreter and runpy is imported before
+# snix, which would hide those modules from the check.
+CHILD = """
+import os, sys, time, runpy
+start = time.time()
+before = set(sys.modules)
+out, snix = sys.argv[1], sys.argv[2]
+sys.argv = ['snix'] + sys.argv[3:]
+sys.path.insert(0, os.path.dirname(snix))
+sys.stdout = sys.stderr = open(os.devnull, 'w')
+try:
+    runpy.run_path(snix, run_name='__main__')
+except SystemExit:
+    pass
+elapsed = (time.time() - start) * 1000
+modules = sorted(name for name in set(sys.modules) - before if sys.modules[name] is not None)
+import json
+with open(out, 'w') as f:
+    json.dump({'ms': elapsed, 'modules': modules}, f)
+"""
+
+
+def _measure(root, env, argv):
+    out = os.path.join(root, 'result.json')
+    subprocess.check_call([sys.executable, '-c', CHILD, out, os.path.join(SNIX_DIR, 'snix')] + argv, cwd=root, env=env)
+    with open(out, 'r') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=10, help="Number of runs per scenario. The median counts.")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplies every budget, e.g. for slow CI hosts.")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='snix-startup-')
+    try:
+        home = os.path.join(root, 'home')
+        os.makedirs(os.path.join(home, '.snix'))
+        with open(os.path.join(home, '.snix', 'snix.conf'), 'w') as f:
+            f.write("[config]\nsnix.home = {0}\n".format(os.path.join(root, 'lab')))
+        manifest = os.path.join(root, 'startup.snix')
+        with open(manifest, 'w') as f:
+            json.dump(MANIFEST, f)
+        env = dict(os.environ, HOME=home)
+        # Caches the manifest, so the test scenario measures the common case.
+        _measure(root, env, ['test', manifest, '--no-probe'])
+
+        failures = []
+        print("{0:<16} {1:>10} {2:>10} {3:>8}".format('scenario', 'median ms', 'budget ms', 'modules'))
+        for name, argv, budget, forbidden in SCENARIOS:
+            argv = [arg.format(manifest=manifest) for arg in argv]
+            results = [_measure(root, env, argv) for _ in range(args.repeat)]
+            median = sorted(result['ms'] for result in results)[len(results) // 2]
+            modules = results[-1]['modules']
+            budget *= args.scale
+            print("{0:<16} {1:>10.1f} {2:>10.1f} {3:>8}".format(name, median, budget, len(modules)))
+            if median > budget:
+                failures.append("{0} took {1:.1f}ms, the budget is {2:.1f}ms".format(name, median, budget))
+            loaded = [module for module in forbidden if module in modules]
+            if loaded:
+                failures.append("{0} imported {1}".format(name, ', '.join(loaded)))
+        for failure in failures:
+            print("FAIL: " + failure)
+        return 1 if failures else 0
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import os
+
+import snixLogger
+
+logger = snixLogger.SnixLogger.logger()
+
+MANIFESTS_DIR = os.path.join('.cache', 'manifests')
+SCRIPTS_DIR = os.path.join('.cache', 'scripts')
+CACHE_FORMAT = 5
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def digest(value):
+    """A stable hash of a JSON value."""
+    return hashlib.sha1(json.dumps(value, sort_keys=True)).hexdigest()
+
+
+def write_atomically(path, data):
+    """Writes data as JSON next to path and renames it into place, so readers never see a partial file."""
+    import tempfile
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            # json.dump encodes piece by piece in Python. dumps uses the C encoder, which is many times faster.
+            f.write(json.dumps(data))
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class ManifestCache:
+    """Caches the fully merged manifest under the snix home.
+    An entry is keyed by the root manifest and is valid as long as none of the files it was built from changed.
+    A file whose mtime and size are unchanged is trusted; otherwise its content hash decides."""
+
+    def __init__(self, snix_home):
+        self._root = os.path.join(snix_home, MANIFESTS_DIR)
+
+    def _entry_for(self, manifest_file):
+        key = hashlib.sha1(os.path.abspath(manifest_file)).hexdigest()
+        return os.path.join(self._root, key + '.json')
+
+    def load(self, manifest_file):
+        """Returns the cached manifest dict, or None if there is no valid entry."""
+        entry = self._entry_for(manifest_file)
+        try:
+            with open(entry, 'r') as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if cached.get('format') != CACHE_FORMAT:
+            return None
+        for recorded in cached['inputs']:
+            if not self._unchanged(recorded):
+                logger.info("{0} changed since the manifest was cached.".format(recorded['path']))
+                return None
+        logger.info("Using cached manifest for {0}".format(manifest_file))
+        return cached['manifest']
+
+    @staticmethod
+    def _unchanged(recorded):
+        try:
+            st = os.stat(recorded['path'])
+        except OSError:
+            return False
+        if st.st_mtime == recorded['mtime'] and st.st_size == recorded['size']:
+            return True
+        return file_hash(recorded['path']) == recorded['sha256']
+
+    def store(self, manifest_file, inputs, manifest):
+        recorded = []
+        for path in inputs:
+            st = os.stat(path)
+            recorded.append({'path': os.path.abspath(path), 'mtime': st.st_mtime, 'size': st.st_size,
+                             'sha256': file_hash(path)})
+        try:
+            write_atomically(self._entry_for(manifest_file),
+                             {'format': CACHE_FORMAT, 'inputs': recorded, 'manifest': manifest})
+        except (IOError, OSError) as e:
+            logger.warn("Could not cache the manifest: {0}".format(e))
+
+
+class ScriptCache:
+    """Remembers, per script, the fingerprint of the inputs it last succeeded with and the outputs it made.
+    A script is up to date while its fingerprint is the same and every output exists. The state of each input file
+    is kept too, so a file whose mtime and size are unchanged isn't hashed again."""
+
+    def __init__(self, snix_home):
+        self._root = os.path.join(snix_home, SCRIPTS_DIR)
+
+    def _entry_for(self, location):
+        return os.path.join(self._root, hashlib.sha1(location.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, location):
+        try:
+            with open(self._entry_for(location), 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    @staticmethod
+    def hash_files(paths, previous):
+        """Returns path -> {mtime, size, sha256} for paths, reusing the hashes in previous for unchanged files."""
+        files = {}
+        for path in paths:
+            st = os.stat(path)
+            recorded = previous.get(path)
+            if recorded and recorded['mtime'] == st.st_mtime and recorded['size'] == st.st_size:
+                files[path] = recorded
+            else:
+                files[path] = {'mtime': st.st_mtime, 'size': st.st_size, 'sha256': file_hash(path)}
+        return files
+
+    @staticmethod
+    def up_to_date(entry, fingerprint, outputs):
+        return entry.get('fingerprint') == fingerprint and all(os.path.exists(output) for output in outputs)
+
+    def store(self, location, fingerprint, files):
+        try:
+            write_atomically(self._entry_for(location), {'fingerprint': fingerprint, 'files': files})
+        except (IOError, OSError) as e:
+            logger.warn("Could not remember that {0} is up to date: {1}".format(location, e))
@@ -2,7 +2,8 @@
 import os
 
 import snixLogger
-from snixCore import execute, execute_in_dir_and_revert, abort
+from engine import Spawn, Return, drive
+from snixCore import ExecutionContext, abort
 
 logger = snixLogger.SnixLogger.logger()
 
@@ -17,9 +18,12 @@ class Command:
         self._use_shell = use_shell
 
     def execute(self):
+        return drive(self.execute_async())
+
+    def execute_async(self):
         command = self._context['command']
         _exec_dir = self._context['command_exec_dir']
         if not os.path.isdir(_exec_dir):
             abort("{0} is not a valid path".format(_exec_dir))
-        with execute_in_dir_and_revert(_exec_dir):
-            execute(command, self._use_shell)
+        ret = yield Spawn(command, self._use_shell, ExecutionContext(_exec_dir), interactive=True)
+        raise Return(ret)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+import errno
+import hashlib
+import os
+import threading
+import time
+
+import snixLogger
+from engine import Call, Return, drive
+from tracing import tracer
+from snixCore import abort
+
+logger = snixLogger.SnixLogger.logger()
+
+CHUNK_SIZE = 1 << 16
+TIMEOUT = 30
+PARTIAL_SUFFIX = '.part'
+VALIDATOR_SUFFIX = '.validator'
+
+
+class Limits:
+    """Caps shared by every download in the process: how many connections can be open at once and how many bytes per
+    second they can read in total."""
+
+    def __init__(self, max_connections=4, max_rate=None):
+        self.connections = threading.BoundedSemaphore(max_connections)
+        self._max_rate = max_rate
+        self._lock = threading.Lock()
+        self._allowance = max_rate or 0
+        self._last = time.time()
+
+    def throttle(self, size):
+        """Blocks until size more bytes fit in the bandwidth budget."""
+        if not self._max_rate:
+            return
+        with self._lock:
+            now = time.time()
+            self._allowance = min(self._max_rate, self._allowance + (now - self._last) * self._max_rate)
+            self._last = now
+            self._allowance -= size
+            wait = -self._allowance / self._max_rate if self._allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+limits = Limits()
+
+
+def configure(max_connections, max_rate=None):
+    """Sets the process wide download caps. max_rate is in bytes per second."""
+    global limits
+    limits = Limits(max_connections, max_rate)
+
+
+def _hash_of(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha
+
+
+def _remove(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _read_validator(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+
+def _write_validator(path, response):
+    """Keeps what identifies the version of the file being downloaded next to its .part: the ETag if it's a strong
+    one, which is all If-Range accepts, or else Last-Modified."""
+    headers = response.info()
+    etag = headers.getheader('ETag')
+    validator = etag if etag and not etag.startswith('W/') else headers.getheader('Last-Modified')
+    if validator:
+        with open(path, 'w') as f:
+            f.write(validator + '\n')
+    else:
+        _remove(path)
+
+
+def _open(request, timeout, offset):
+    """Sends the request. Returns None if it resumes from offset and the server answers 416, i.e. that there is
+    nothing at offset."""
+    import urllib2
+    try:
+        return urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        return None
+
+
+def _save(url, response, partial, validator_file, offset):
+    """Streams the response to partial, after the offset bytes already there if the server resumed. Returns the
+    sha256 of the whole file, the offset actually resumed from and the number of bytes received."""
+    received = 0
+    try:
+        if offset and response.getcode() != 206:
+            logger.info("{0} changed or does not support resuming. Starting over.".format(url))
+            offset = 0
+        if not offset:
+            _write_validator(validator_file, response)
+        sha = _hash_of(partial) if offset else hashlib.sha256()
+        if offset:
+            logger.info("Resuming {0} from byte {1}".format(url, offset))
+        with open(partial, 'ab' if offset else 'wb') as f:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                limits.throttle(len(chunk))
+                f.write(chunk)
+                sha.update(chunk)
+                received += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        response.close()
+    return sha, offset, received
+
+
+def fetch(url, target, sha256=None, timeout=TIMEOUT):
+    """Downloads url to the file target and returns target.
+    Data is streamed to target.part, which is renamed into place only once it's complete and matches sha256 if one is
+    given. A .part left behind by an interrupted download is resumed with an HTTP Range request. The request carries
+    the ETag or Last-Modified of the first attempt in If-Range, so a file that changed since is downloaded again in
+    full rather than appended to the old bytes."""
+    import urllib2
+    if os.path.exists(target):
+        if not sha256 or _hash_of(target).hexdigest() == sha256.lower():
+            logger.info("{0} is already downloaded.".format(target))
+            return target
+        logger.warn("{0} doesn't match its sha256. Downloading it again.".format(target))
+        os.remove(target)
+
+    try:
+        os.makedirs(os.path.dirname(target))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    partial = target + PARTIAL_SUFFIX
+    validator_file = partial + VALIDATOR_SUFFIX
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    validator = _read_validator(validator_file) if offset else None
+    if offset and not validator:
+        logger.info("Can't tell whether {0} changed since {1} was written. Starting over.".format(url, partial))
+        offset = 0
+    request = urllib2.Request(url)
+    if offset:
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+        request.add_header('If-Range', validator)
+    with limits.connections, tracer.span('fetch ' + os.path.basename(target), url=url) as span:
+        response = _open(request, timeout, offset)
+        if response is not None:
+            sha, offset, received = _save(url, response, partial, validator_file, offset)
+            span.set(bytes=received, resumed_from=offset)
+    if response is None:
+        # The .part is already as long as the file, or longer because the file shrank.
+        logger.info("{0} can't be resumed from byte {1}. Starting over.".format(url, offset))
+        _remove(partial, validator_file)
+        return fetch(url, target, sha256, timeout)
+
+    if sha256 and sha.hexdigest() != sha256.lower():
+        _remove(partial, validator_file)
+        raise ValueError("{0} has sha256 {1}, expected {2}".format(url, sha.hexdigest(), sha256))
+    os.rename(partial, target)
+    _remove(validator_file)
+    return target
+
+
+def file_name(url, name=None):
+    """The name a download is saved as: the one the manifest gives, or the last part of the URL."""
+    return name or os.path.basename(url.split('?')[0])
+
+
+class Download:
+    """Represents a file that snix downloads into <snix home>/downloads. Archives with extract_to set are extracted
+    into that directory next to it."""
+
+    def __init__(self, context):
+        if not type(context) is dict:
+            abort('Cannot download a file without the configuration.')
+        self._context = context
+
+    def fetch(self):
+        return drive(self.fetch_async())
+
+    def fetch_async(self):
+        url = self._context['url']
+        msg = "Downloading {0}...".format(url)
+        logger.info(msg)
+        try:
+            yield Call(fetch, url, self.target(), self._context.get('sha256'))
+            if self._context.get('extract_to'):
+                from extract import extract
+                yield Call(extract, self.target(), self.extracted_location(), self._context.get('sha256'),
+                           self._context.get('jobs', 1))
+            ret = 0
+        except (EnvironmentError, ValueError) as e:
+            logger.error(msg + str(e))
+            ret = 1
+        logger.info(msg + 'StatusCode:' + str(ret))
+        raise Return(ret)
+
+    def inputs(self):
+        return {'url': self._context['url'], 'sha256': self._context.get('sha256'),
+                'extract_to': self._context.get('extract_to')}
+
+    def name(self):
+        return file_name(self._context['url'], self._context.get('name'))
+
+    def target(self):
+        return os.path.join(self._context['download_dir'], self.name())
+
+    def extracted_location(self):
+        return os.path.join(self._context['download_dir'], self._context['extract_to'])
+
+    def task_id(self):
+        return "download:" + self.name()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections import deque
+
+import snixLogger
+from multiplexer import OutputMultiplexer, EXIT_GRACE
+from snixCore import ExecutionContext, current_task, execute, execute_and_capture
+from tracing import traced, tracer
+
+logger = snixLogger.SnixLogger.logger()
+
+TIMED_OUT = 124
+CANCELLED = 130
+# A process can exit without its pipes closing, which gives the loop nothing to wake up for. Running processes are
+# checked this often.
+EXIT_POLL = 0.1
+
+
+class Return(Exception):
+    """Raised by an action coroutine to finish with a status code, the way `return value` would in Python 3."""
+
+    def __init__(self, value):
+        Exception.__init__(self, value)
+        self.value = value
+
+
+class Spawn:
+    """Yielded by an action coroutine to run a command in an ExecutionContext. The coroutine is resumed with the
+    status code, or with (status code, stdout) if capture is set."""
+
+    def __init__(self, cmd, use_shell=False, context=None, capture=False, interactive=False, timeout=None):
+        self.cmd = cmd
+        self.use_shell = use_shell
+        self.context = context or ExecutionContext()
+        self.capture = capture
+        self.interactive = interactive
+        self.timeout = timeout
+
+    def __str__(self):
+        return ' '.join(self.cmd) if type(self.cmd) is list else self.cmd
+
+
+class Call:
+    """Yielded by an action coroutine to run blocking Python code, e.g. network I/O, off the event loop. The coroutine
+    is resumed with the return value, or the exception is raised inside it."""
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return self.fn.__name__
+
+
+def nested(coroutine):
+    """Lets an action coroutine yield another coroutine, e.g. a backend's install, and be resumed with its result,
+    the way `yield from` would in Python 3. Only Spawn and Call requests reach the driver."""
+    stack = [coroutine]
+    value = error = None
+    try:
+        while True:
+            try:
+                request = stack[-1].throw(*error) if error else stack[-1].send(value)
+            except Return as r:
+                if len(stack) == 1:
+                    raise
+                stack.pop()
+                value, error = r.value, None
+                continue
+            except StopIteration:
+                if len(stack) == 1:
+                    return
+                stack.pop()
+                value = error = None
+                continue
+            except Exception:
+                if len(stack) == 1:
+                    raise
+                stack.pop()
+                error = sys.exc_info()
+                continue
+            if isinstance(request, types.GeneratorType):
+                stack.append(request)
+                value = error = None
+                continue
+            try:
+                value, error = (yield request), None
+            except GeneratorExit:
+                raise
+            except Exception:
+                error = sys.exc_info()
+    finally:
+        for pending in reversed(stack):
+            pending.close()
+
+
+def _status(value):
+    return value[0] if type(value) is tuple else value
+
+
+def drive(coroutine):
+    """Runs an action coroutine to completion on the calling thread, one blocking command at a time.
+    This is all the synchronous actions do."""
+    coroutine = nested(coroutine)
+    value = None
+    error = None
+    last = 0
+    try:
+        while True:
+            spawn = coroutine.throw(*error) if error else coroutine.send(value)
+            error = None
+            if isinstance(spawn, Call):
+                try:
+                    value = spawn.fn(*spawn.args)
+                except Exception:
+                    error = sys.exc_info()
+                continue
+            if spawn.capture:
+                value = execute_and_capture(spawn.cmd, spawn.context)
+            else:
+                value = execute(spawn.cmd, spawn.use_shell, spawn.context, spawn.interactive, spawn.timeout)
+            last = _status(value)
+    except Return as r:
+        return r.value
+    except StopIteration:
+        return last
+
+
+class Job:
+    """An action coroutine being driven by the Engine."""
+
+    def __init__(self, name, coroutine, on_done, timeout):
+        self.name = name
+        self.coroutine = coroutine
+        self.on_done = on_done
+        self.deadline = time.time() + timeout if timeout else None
+        self.result = None
+        self.done = False
+        self.last = 0
+        self.spawn = None
+        self.process = None
+        self.channel = None
+        self.spawn_deadline = None
+        self.killed_with = None
+        self.exited_at = None
+        self.detached = False
+        self.span = None
+
+
+class Engine:
+    """Drives action coroutines on a single thread.
+    Each coroutine yields Spawn requests. The engine starts the process, streams its output through an unthreaded
+    OutputMultiplexer and resumes the coroutine when the process exits, so any number of actions can be in flight
+    without a thread each. Actions can be given a timeout and can be cancelled, which kills their current process.
+    A Call request runs on a short-lived thread that wakes the loop when it's done."""
+
+    def __init__(self, max_processes=None, timeout=None):
+        self._mux = OutputMultiplexer(sys.stdout, threaded=False)
+        self._max_processes = max_processes
+        self._timeout = timeout
+        self._queued = deque()
+        self._running = []
+        self._calls = 0
+        self._calls_done = deque()
+
+    def submit(self, coroutine, name=None, on_done=None, timeout=None):
+        """Starts driving a coroutine. on_done is called with the Job once it has a result."""
+        job = Job(name or 'job', nested(coroutine), on_done, timeout or self._timeout)
+        self._step(job, None)
+        return job
+
+    def run(self, coroutines, timeout=None):
+        """Drives all the coroutines to completion and returns their results in order."""
+        jobs = [self.submit(coroutine, timeout=timeout) for coroutine in coroutines]
+        try:
+            while not all(job.done for job in jobs):
+                self.run_once()
+        except KeyboardInterrupt:
+            for job in jobs:
+                self.cancel(job)
+            raise
+        return [job.result for job in jobs]
+
+    def run_once(self):
+        """Starts whatever can be started, waits for output or the next deadline and resumes finished actions."""
+        self._start_queued()
+        self._mux.iterate(self._next_timeout())
+        while self._calls_done:
+            job, value, error = self._calls_done.popleft()
+            self._calls -= 1
+            self._step(job, value, error)
+        self._reap()
+        self._expire()
+
+    def cancel(self, job, status=CANCELLED):
+        if job.done:
+            return
+        if job.process:
+            job.killed_with = status
+            job.process.kill()
+            self._mux.detach(job.channel)
+            return
+        self._queued = deque((j, s) for j, s in self._queued if j is not job)
+        job.coroutine.close()
+        self._finish(job, status)
+
+    def _step(self, job, value, error=None):
+        while True:
+            try:
+                spawn = job.coroutine.throw(*error) if error else job.coroutine.send(value)
+            except Return as r:
+                return self._finish(job, r.value)
+            except StopIteration:
+                return self._finish(job, job.last)
+            except (Exception, SystemExit) as e:
+                logger.error("{0} raised {1}".format(job.name, e))
+                return self._finish(job, 1)
+            if isinstance(spawn, Call):
+                return self._call(job, spawn)
+            if not spawn.interactive:
+                self._queued.append((job, spawn))
+                return
+            # Interactive commands need the terminal, so they block the loop.
+            value = execute(spawn.cmd, spawn.use_shell, spawn.context, True)
+            job.last = value
+
+    def _call(self, job, call):
+        def _run():
+            current_task.name = job.name
+            value = error = None
+            try:
+                value = call.fn(*call.args)
+            except Exception:
+                error = sys.exc_info()
+            self._calls_done.append((job, value, error))
+            self._mux.wake()
+        self._calls += 1
+        thread = threading.Thread(target=_run, name="snix-call-{0}".format(job.name))
+        thread.daemon = True
+        thread.start()
+
+    def _finish(self, job, result):
+        job.done = True
+        job.result = result
+        if job.on_done:
+            job.on_done(job)
+
+    def _start_queued(self):
+        while self._queued and (not self._max_processes or len(self._running) < self._max_processes):
+            job, spawn = self._queued.popleft()
+            logger.info("Execute...` {0} ` in {1}".format(spawn, spawn.context))
+            job.span = tracer.begin(str(spawn), job.name, cwd=str(spawn.context))
+            args, shell = spawn.context.command(spawn.cmd, spawn.use_shell)
+            try:
+                process = subprocess.Popen(args, stdin=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                           shell=shell, **spawn.context.popen_args())
+            except OSError as e:
+                logger.warn("Could not run {0}: {1}".format(spawn, e))
+                tracer.end(job.span, exit_code=127)
+                job.last = 127
+                self._step(job, (127, '') if spawn.capture else 127)
+                continue
+            job.spawn = spawn
+            job.process = process
+            job.channel = self._mux.watch(job.name, process, capture=spawn.capture)
+            job.spawn_deadline = time.time() + spawn.timeout if spawn.timeout else None
+            self._running.append(job)
+
+    def _next_timeout(self):
+        if any(job.channel.closed.is_set() for job in self._running):
+            # Output is done but the process hasn't been reaped yet.
+            return 0.05
+        deadlines = [d for job in self._running if job.killed_with is None
+                     for d in (job.deadline, job.spawn_deadline) if d]
+        deadlines += [job.deadline for job, _ in self._queued if job.deadline]
+        timeout = max(0, min(deadlines) - time.time()) if deadlines else None
+        if self._running:
+            timeout = EXIT_POLL if timeout is None else min(timeout, EXIT_POLL)
+        return timeout
+
+    def _reap(self):
+        now = time.time()
+        for job in list(self._running):
+            if job.process.poll() is None:
+                continue
+            if not job.channel.closed.is_set():
+                # The process exited but something it started in the background still holds the pipes.
+                if job.exited_at is None:
+                    job.exited_at = now
+                elif now - job.exited_at >= EXIT_GRACE and not job.detached:
+                    job.detached = True
+                    self._mux.detach(job.channel)
+                continue
+            self._running.remove(job)
+            job.process.stdout.close()
+            job.process.stderr.close()
+            ret = job.process.returncode
+            spawn, channel = job.spawn, job.channel
+            job.process = job.channel = job.spawn = job.exited_at = None
+            job.detached = False
+            logger.info("Execute...StatusCode:{0}...Done!".format(ret))
+            tracer.end(job.span, exit_code=ret)
+            if job.killed_with is not None:
+                logger.warn("{0} was stopped: {1}".format(job.name, 'timed out' if job.killed_with == TIMED_OUT
+                                                          else 'cancelled'))
+                job.coroutine.close()
+                self._finish(job, job.killed_with)
+                continue
+            if ret:
+                logger.warn("{0} exited with error code {1}. Last lines of output:\n{2}".format(
+                    spawn, ret, '\n'.join(channel.tail)))
+            job.last = ret
+            self._step(job, (ret, ''.join(channel.captured)) if spawn.capture else ret)
+
+    def _expire(self):
+        now = time.time()
+        for job in list(self._running):
+            if job.killed_with is None and any(d and d <= now for d in (job.deadline, job.spawn_deadline)):
+                self.cancel(job, TIMED_OUT)
+        for job, _ in list(self._queued):
+            if job.deadline and job.deadline <= now:
+                self.cancel(job, TIMED_OUT)
+
+
+class EngineExecutor:
+    """Lets the Scheduler run its tasks' coroutines on an Engine instead of a pool of threads."""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._done = deque()
+
+    def submit(self, task):
+        def _on_done(job):
+            self._done.append((task, job.result))
+        self._engine.submit(traced(task.task_id, task.async_action()), task.task_id, _on_done)
+
+    def wait(self):
+        while not self._done:
+            self._engine.run_once()
+        return self._done.popleft()
+
+    def shutdown(self):
+        pass
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import os
+import tarfile
+import threading
+import zipfile
+
+import snixLogger
+from cache import file_hash, write_atomically
+from tracing import tracer
+
+logger = snixLogger.SnixLogger.logger()
+
+CHUNK_SIZE = 1 << 16
+EXTRACTED_MANIFEST = '.snix-extracted.json'
+# Zips with less uncompressed data than this aren't worth a pool of workers.
+POOL_THRESHOLD = 16 << 20
+
+
+def _safe_path(target_dir, name):
+    """Where member name goes under target_dir, which is target_dir itself for the ./ entry archives made with
+    `tar -C dir .` start with. Aborts extraction of members that would escape it."""
+    root = os.path.normpath(target_dir)
+    path = os.path.normpath(os.path.join(target_dir, name))
+    if os.path.isabs(name) or (path != root and not path.startswith(root + os.sep)):
+        raise ValueError("Refusing to extract {0} outside of {1}".format(name, target_dir))
+    return path
+
+
+def _inside(root, path):
+    return path == root or path.startswith(root + os.sep)
+
+
+def _check_real(target_dir, path, link=None):
+    """Aborts if the directory path goes into resolves outside of target_dir, or if link, a symlink's target relative
+    to that directory, does. Checking the names alone isn't enough: a symlink extracted earlier, e.g. a -> ., can
+    lead a later member such as a/b/up -> ../.. out of target_dir."""
+    root = os.path.realpath(target_dir)
+    parent = os.path.realpath(os.path.dirname(path))
+    if not _inside(root, parent):
+        raise ValueError("Refusing to extract {0}, which goes through a link outside of {1}".format(path, target_dir))
+    if link is not None and not _inside(root, os.path.realpath(os.path.join(parent, link))):
+        raise ValueError("Refusing to extract {0}, which links to {1} outside of {2}".format(path, link, target_dir))
+
+
+def _copy(source, path, mode=None):
+    """Streams the file object source to path and returns its sha256."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    sha = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            f.write(chunk)
+            sha.update(chunk)
+    if mode:
+        os.chmod(path, mode)
+    return sha.hexdigest()
+
+
+def _open_tar(archive):
+    """Opens a tar for streaming, i.e. members are read in order and the archive is never seeked or held in memory."""
+    if archive.endswith(('.xz', '.txz')):
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                raise ValueError("Extracting {0} needs the backports.lzma package.".format(archive))
+        return tarfile.open(fileobj=lzma.LZMAFile(archive), mode='r|')
+    return tarfile.open(archive, mode='r|*')
+
+
+def _extract_tar(archive, target_dir):
+    members = {}
+    with _open_tar(archive) as tar:
+        for member in tar:
+            path = _safe_path(target_dir, member.name)
+            if path == os.path.normpath(target_dir):
+                continue
+            _check_real(target_dir, path, member.linkname if member.issym() else None)
+            if member.isfile():
+                members[member.name] = _copy(tar.extractfile(member), path, member.mode & 0o7777)
+            elif member.isdir():
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            elif member.issym() or member.islnk():
+                base = os.path.dirname(member.name) if member.issym() else ''
+                _safe_path(target_dir, os.path.join(base, member.linkname))
+                if member.islnk():
+                    linked = os.path.join(target_dir, member.linkname)
+                    _check_real(target_dir, linked, os.path.basename(linked))
+                if os.path.lexists(path):
+                    os.remove(path)
+                tar.extract(member, target_dir)
+    return members
+
+
+def _extract_zip(archive, target_dir, jobs):
+    with zipfile.ZipFile(archive) as zf:
+        infos = [info for info in zf.infolist() if not info.filename.endswith('/')]
+        for info in zf.infolist():
+            path = _safe_path(target_dir, info.filename)
+            # Links a previous extraction left in target_dir count too.
+            _check_real(target_dir, path)
+            if info.filename.endswith('/') and not os.path.isdir(path):
+                os.makedirs(path)
+    members = {}
+    errors = []
+    lock = threading.Lock()
+
+    def _worker(share):
+        # Each worker reads through its own handle so members are inflated in parallel.
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                for info in share:
+                    mode = (info.external_attr >> 16) & 0o7777
+                    with zf.open(info) as source:
+                        digest = _copy(source, _safe_path(target_dir, info.filename), mode)
+                    with lock:
+                        members[info.filename] = digest
+        except Exception as e:
+            errors.append(e)
+
+    workers = 1
+    if sum(info.file_size for info in infos) >= POOL_THRESHOLD:
+        workers = max(1, min(jobs, len(infos)))
+    if workers == 1:
+        _worker(infos)
+    else:
+        threads = [threading.Thread(target=_worker, args=(infos[i::workers],), name="snix-unzip-%d" % i)
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return members
+
+
+def is_archive(path):
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path) or path.endswith(('.tar.xz', '.txz'))
+
+
+def _unchanged(target_dir, archive_sha256):
+    try:
+        with open(os.path.join(target_dir, EXTRACTED_MANIFEST), 'r') as f:
+            recorded = json.load(f)
+    except (IOError, ValueError):
+        return False
+    if recorded.get('archive') != archive_sha256:
+        return False
+    return all(os.path.isfile(os.path.join(target_dir, name)) for name in recorded['members'])
+
+
+def extract(archive, target_dir, sha256=None, jobs=1):
+    """Extracts a zip or tar(.gz/.bz2/.xz) archive into target_dir and returns target_dir.
+    The hashes of the extracted members are recorded in target_dir, so extracting the same archive again is skipped
+    as long as its members are still there. Zips with a lot of data are inflated by up to `jobs` threads."""
+    if not os.path.exists(archive):
+        raise ValueError("Cannot extract a non-existant file:{}".format(archive))
+    archive_sha256 = sha256.lower() if sha256 else file_hash(archive)
+    if _unchanged(target_dir, archive_sha256):
+        logger.info("{0} is already extracted to {1}".format(archive, target_dir))
+        return target_dir
+
+    logger.info("Extracting {0} to {1}".format(archive, target_dir))
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    with tracer.span('extract ' + os.path.basename(archive), archive=archive) as span:
+        if zipfile.is_zipfile(archive):
+            members = _extract_zip(archive, target_dir, jobs)
+        elif is_archive(archive):
+            members = _extract_tar(archive, target_dir)
+        else:
+            raise ValueError("{} is not a valid compressed file.".format(archive))
+        span.set(members=len(members))
+    write_atomically(os.path.join(target_dir, EXTRACTED_MANIFEST), {'archive': archive_sha256, 'members': members})
+    logger.info("Extracted {0} files from {1}".format(len(members), archive))
+    return target_dir
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+import json
+import os
+from collections import OrderedDict
+
+import snixLogger
+from mirror import MirrorCache
+from records import load_json
+from repo import Repo, updates
+from scheduler import Scheduler, Task, SUCCEEDED
+from snixCore import abort, execute_and_capture
+from tracing import tracer
+
+logger = snixLogger.SnixLogger.logger()
+
+ROOT = 'root'
+
+
+class IncludeResolver:
+    """Resolves the include graph of a manifest.
+    The graph is walked breadth first. All the upstream repos needed for a level are fetched concurrently, each
+    (repo, path) is loaded only once however many manifests include it, and cycles are reported with their path.
+    Include repos that are already cloned are left as they are, unless the resolver is asked to update them. Then
+    they are fetched and fast-forwarded along with the clones of the level.
+    An offline resolver never fetches. Includes whose repo isn't cloned are read from the mirror cache, and the ones
+    that aren't there either are left out and reported by unresolved()."""
+
+    def __init__(self, snix_home, jobs=1, validator=None, offline=False, stream=False, update=False):
+        self._snix_home = snix_home
+        self._jobs = jobs
+        self._validator = validator
+        self._offline = offline
+        self._stream = stream
+        self._update = update
+        self._unresolved = []
+        self._errors = []
+        self._manifests = OrderedDict()
+        self._files = {}
+        self._edges = {}
+        self._fetched = set()
+
+    def resolve(self, manifest_file, data):
+        """Returns (name, file, manifest) for the root and every include it reaches. Includes come before the
+        manifests that include them, so later entries are the ones that should take precedence."""
+        self._manifests[ROOT] = data
+        self._files[ROOT] = manifest_file
+        level = [ROOT]
+        while level:
+            pending = OrderedDict()
+            for node in level:
+                self._edges[node] = []
+                if not self._valid(node):
+                    continue
+                for include in self._manifests[node].get('includes', []):
+                    key = self._key(include)
+                    self._edges[node].append(key)
+                    if key not in self._manifests and key not in pending:
+                        pending[key] = include
+            with tracer.span('fetch includes', repos=len(pending)):
+                self._fetch([include['upstreamRepo'] for include in pending.values()])
+            for key, include in pending.items():
+                self._load(key, include)
+            level = pending.keys()
+        if self._errors:
+            abort("The manifest has {0} error(s):\n{1}".format(len(self._errors), '\n'.join(self._errors)))
+        return [(node, self._files[node], self._manifests[node]) for node in self._post_order()]
+
+    def _valid(self, node):
+        if not self._validator:
+            return True
+        errors = self._validator.errors(self._manifests[node], self._files[node])
+        self._errors.extend(errors)
+        return not errors
+
+    def files(self):
+        return [self._files[node] for node in self._manifests if node != ROOT and os.path.isfile(self._files[node])]
+
+    def unresolved(self):
+        """The includes an offline resolver could not read."""
+        return self._unresolved
+
+    def complete(self):
+        """True if every include was read from a checkout, so the result can be cached against those files."""
+        return len(self.files()) == len(self._manifests) - 1
+
+    @staticmethod
+    def _repo(url):
+        return Repo({'repo_location': url})
+
+    def _key(self, include):
+        return "{0}/{1}".format(self._repo(include['upstreamRepo']).dir_name(), include['pathRelativeToGroupManifestDir'])
+
+    def _fetch(self, urls):
+        if self._offline:
+            return
+        scheduler = Scheduler(self._jobs)
+        for url in OrderedDict.fromkeys(urls):
+            # The manifests are read from the working tree, so an updated include repo has to be fast-forwarded.
+            repo = Repo({'repo_location': url, 'snix_root': self._snix_home, 'fast_forward': True})
+            exists = os.path.exists(os.path.join(self._snix_home, repo.dir_name()))
+            if url in self._fetched or (exists and not self._update):
+                continue
+            self._fetched.add(url)
+            scheduler.add(Task(repo.task_id(), repo.clone, lock=repo.lock_domain()))
+            scheduler.limit(repo.lock_domain(), updates.per_host)
+        failed = [task_id for task_id, status in scheduler.run().items() if status != SUCCEEDED]
+        if failed:
+            abort("Could not fetch include repos: {0}".format(', '.join(failed)))
+
+    def _load(self, key, include):
+        grp_dir = include['pathRelativeToGroupManifestDir']
+        repo_dir = self._repo(include['upstreamRepo']).dir_name()
+        include_file = os.path.join(self._snix_home, repo_dir, grp_dir, grp_dir + '.snix')
+        if self._offline and not os.path.isfile(include_file):
+            return self._load_offline(key, include, os.path.join(grp_dir, grp_dir + '.snix'))
+        if not os.path.isfile(include_file):
+            abort("{0} is included but {1} does not exist.".format(key, include_file))
+        self._manifests[key] = load_json(include_file, self._stream)
+        self._files[key] = include_file
+        logger.info("Loaded include {0} from {1}".format(key, include_file))
+
+    def _load_offline(self, key, include, path):
+        mirror = MirrorCache(self._snix_home).path_for(include['upstreamRepo'])
+        ret, out = 1, ''
+        if os.path.isdir(mirror):
+            ret, out = execute_and_capture(['git', '--git-dir=' + mirror, 'show', 'HEAD:' + path])
+        self._files[key] = "{0}:{1}".format(mirror, path)
+        try:
+            self._manifests[key] = json.loads(out) if ret == 0 else {}
+        except ValueError:
+            self._manifests[key] = {}
+            ret = 1
+        if ret:
+            logger.warn("{0} is not fetched yet. Leaving it out.".format(key))
+            self._unresolved.append(key)
+        else:
+            logger.info("Loaded include {0} from the mirror of {1}".format(key, include['upstreamRepo']))
+
+    def _post_order(self):
+        ordered = []
+        state = {}
+
+        def _visit(node, path):
+            if state.get(node) == 'done':
+                return
+            if state.get(node) == 'visiting':
+                cycle = path[path.index(node):] + [node]
+                abort("Include cycle detected: {0}".format(' -> '.join(cycle)))
+            state[node] = 'visiting'
+            for child in self._edges.get(node, []):
+                _visit(child, path + [node])
+            state[node] = 'done'
+            ordered.append(node)
+
+        _visit(ROOT, [])
+        return ordered
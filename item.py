@@ -1,14 +1,8 @@
 #!/usr/bin/env python
-import re
-import shlex
-import urlparse
-import subprocess
+import backends
 import snixLogger
-import urllib2
 import snixCore
-import shutil
-import os
-import glob
+from engine import Return, drive
 
 logger = snixLogger.SnixLogger.logger()
 
@@ -21,19 +15,29 @@ class Item:
             snixCore.abort('Cannot install an item without the configuration.')
 
         self._context = context
-        # ?self._installer = CommandBuilder.build_install_cmd(item, context)
+        self._backend = backends.get(context['via'])
 
     def install(self):
-        msg = "Installing {0}...".format(self._context['name'])
-        cmd, use_shell = CommandBuilder.build_install_cmd(self._context)
-        logger.info(msg+cmd)
-        ret = snixCore.execute(shlex.split(cmd), use_shell)
-        #logger.info(msg+'StatusCode:'+str(ret))
+        return drive(self.install_async())
+
+    def install_async(self):
+        msg = "Installing {0} via {1}...".format(self._context['name'], self._context['via'])
+        logger.info(msg)
+        ret = yield self._backend.install(self._context, [self._context['name']])
         logger.info(msg+'Done!. StatusCode:'+str(ret))
-        # if out:
-        #     logger.debug(out)
-        # if err:
-        #     logger.error(err)
+        raise Return(ret)
+
+    def task_id(self):
+        return "item:{0}:{1}".format(self._context['via'], self._context['name'])
+
+    def name(self):
+        return self._context['name']
+
+    def via(self):
+        return self._context['via']
+
+    def lock_domain(self):
+        return self._backend.lock
 
     # def remove(self):
     #     logger.info("Removing Item : {0}".format(self._item))
@@ -44,23 +48,106 @@ class Item:
     #     self._installer.update()
 
 
-class CommandBuilder(object):
+class ItemBatch:
+    """A group of items installed via the same backend with a single command.
+    If the batch command fails, the backend is asked which names actually got installed and only the rest are
+    retried one at a time."""
+
+    def __init__(self, context):
+        if not type(context) is dict:
+            snixCore.abort('Cannot install items without the configuration.')
+        self._context = context
+        self._backend = backends.get(context['via'])
+        self.statuses = {}
+
+    def install(self):
+        return drive(self.install_async())
+
+    def install_async(self):
+        names = self._context['names']
+        msg = "Installing {0} via {1}...".format(', '.join(names), self._context['via'])
+        logger.info(msg)
+        ret = yield self._backend.install(self._context, names)
+        if ret == 0:
+            self.statuses = dict((name, 0) for name in names)
+        else:
+            installed = yield self._backend.list_installed(self._context, names)
+            installed = InstalledIndex.normalized(self._context['via'], installed)
+            for name in names:
+                if InstalledIndex.normalize(self._context['via'], name) in installed:
+                    self.statuses[name] = 0
+                elif len(names) == 1:
+                    self.statuses[name] = ret
+                else:
+                    logger.info("Installing {0} on its own...".format(name))
+                    self.statuses[name] = yield self._backend.install(self._context, [name])
+            failed = [name for name in names if self.statuses[name]]
+            if failed:
+                logger.warn(msg + "Failed: {0}".format(', '.join(failed)))
+            ret = 1 if failed else 0
+        logger.info(msg + 'Done!. StatusCode:' + str(ret))
+        raise Return(ret)
+
+    def names(self):
+        return list(self._context['names'])
+
+    def task_id(self):
+        return "items:{0}:{1}".format(self._context['via'], self._context['batch'])
+
+    def lock_domain(self):
+        return self._backend.lock
+
+    def inputs(self):
+        return {'via': self._context['via'], 'names': sorted(self._context['names'])}
+
+
+class InstalledIndex:
+    """An in-memory index of name -> version for what each backend already has installed.
+    It is built with one listing per backend rather than one query per item."""
+
+    @staticmethod
+    def probe(vias, snix_home=None, names=()):
+        index = InstalledIndex()
+        for via in vias:
+            if via in index._versions:
+                continue
+            installed = drive(backends.get(via).list_installed({'via': via, 'snix_root': snix_home}, names))
+            index._versions[via] = InstalledIndex.normalized(via, installed)
+        return index
+
+    @staticmethod
+    def normalized(via, versions):
+        return dict((InstalledIndex.normalize(via, name), version) for name, version in versions.items())
+
+    @staticmethod
+    def normalize(via, name):
+        """The key name is indexed under, which depends on how the backend of via spells what it lists."""
+        return backends.get(via).normalize(name)
 
     @staticmethod
-    def build_install_cmd(context):
-        brew_pattern = re.compile(r"^[bB]rew(-[cC]ask)?$", re.I)
-        # INET_PATTERN = re.compile(r"^http[s]?:\/\/")
-        # LOCAL_PATTERN = re.compile(r"^file:\/\/")
-        via = context['via']
-        # parsedUrl = urlparse.urlparse(via)
-        if re.match(brew_pattern, via):
-            if re.match(r"^[bB]rew$", via):
-                # cmd = ["brew", "install", item['name']]
-                cmd = "brew install {0}".format(context['name'])
-            else:
-                # cmd = ["brew", "cask", "install", item['name']]
-                cmd = "brew cask install {0}".format(context['name'])
-            return cmd, False
+    def from_snapshot(versions):
+        """Rebuilds an index from snapshot(), e.g. one recorded in a plan."""
+        index = InstalledIndex()
+        index._versions = dict((via, dict(names)) for via, names in versions.items())
+        return index
+
+    def __init__(self):
+        self._versions = {}
+
+    def snapshot(self):
+        return self._versions
+
+    def names(self, via):
+        return set(self._versions.get(via, {}))
+
+    def version(self, via, name):
+        """The installed version, or None if the item isn't installed."""
+        return self._versions.get(via, {}).get(InstalledIndex.normalize(via, name))
+
+    def is_installed(self, via, name):
+        return self.version(via, name) is not None
+
+
 #
 #
 # # TODO fix my parameters
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import os
+import time
+
+import snixLogger
+from cache import digest
+
+logger = snixLogger.SnixLogger.logger()
+
+JOURNAL_DIR = os.path.join('.cache', 'journal')
+
+
+class Journal:
+    """An append-only record of the actions of a `snix run`, kept under <snix home>/.cache/journal per manifest.
+    Every line is a JSON event: the run starting, an action starting and an action ending with its status, along with
+    the hash of the action's inputs. Each line is fsync'd before the run moves on, so the journal survives a crash or a
+    Ctrl-C. A new run starts a new journal. A resumed run appends to it and treats an action as done if it succeeded
+    before with the same inputs."""
+
+    def __init__(self, snix_home, manifest_file, resume=False):
+        key = hashlib.sha1(os.path.abspath(manifest_file)).hexdigest()[:12]
+        self._path = os.path.join(snix_home, JOURNAL_DIR, "{0}-{1}.jsonl".format(key, os.path.basename(manifest_file)))
+        self._succeeded = self._read() if resume else {}
+        self._inputs = {}
+        if not os.path.isdir(os.path.dirname(self._path)):
+            os.makedirs(os.path.dirname(self._path))
+        self._file = open(self._path, 'a' if resume else 'w')
+        self._append({'event': 'run', 'resume': resume, 'manifest': os.path.abspath(manifest_file)})
+
+    def _read(self):
+        """Returns task id -> input hash of the actions that succeeded so far."""
+        succeeded = {}
+        try:
+            with open(self._path, 'r') as f:
+                lines = f.readlines()
+        except IOError:
+            logger.warn("There is no journal at {0} to resume from. Running everything.".format(self._path))
+            return succeeded
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # The last line of a journal whose run was killed mid-write.
+                continue
+            if event.get('event') != 'end':
+                continue
+            if event['status'] == 'succeeded':
+                succeeded[event['id']] = event['input']
+            else:
+                succeeded.pop(event['id'], None)
+        return succeeded
+
+    def _append(self, event):
+        event['time'] = time.time()
+        self._file.write(json.dumps(event) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _input_of(self, task):
+        if task.task_id not in self._inputs:
+            self._inputs[task.task_id] = digest(task.inputs())
+        return self._inputs[task.task_id]
+
+    def completed(self, task):
+        """Whether the task succeeded in an earlier attempt of this run and its inputs haven't changed since."""
+        recorded = self._succeeded.get(task.task_id)
+        if recorded is None:
+            return False
+        if recorded != self._input_of(task):
+            logger.info("{0} changed since it succeeded. Running it again.".format(task.task_id))
+            return False
+        return True
+
+    def started(self, task):
+        self._append({'event': 'start', 'id': task.task_id, 'input': self._input_of(task)})
+
+    def finished(self, task):
+        self._append({'event': 'end', 'id': task.task_id, 'input': self._input_of(task), 'status': task.status})
+
+    def path(self):
+        return self._path
+
+    def close(self):
+        self._file.close()
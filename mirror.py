@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+import hashlib
+import os
+import re
+import shutil
+
+import snixLogger
+from engine import Spawn, Return
+
+logger = snixLogger.SnixLogger.logger()
+
+MIRRORS_DIR = os.path.join('.cache', 'mirrors')
+
+class MirrorCache:
+    """A cache of bare mirrors of upstream repos under the snix home.
+    A repo is mirrored once with `git clone --mirror` and only fetched after that. Working copies are cloned from the
+    mirror, which hardlinks its objects instead of transferring them again."""
+
+    def __init__(self, snix_home):
+        self._root = os.path.join(snix_home, MIRRORS_DIR)
+
+    def path_for(self, url):
+        name = re.sub(r'[^\w.-]', '_', url.rstrip('/').split('/')[-1].split(':')[-1])
+        if not name.endswith('.git'):
+            name += '.git'
+        return os.path.join(self._root, hashlib.sha1(url.encode('utf-8')).hexdigest()[:12] + '-' + name)
+
+    def ensure_async(self, url):
+        """Coroutine that creates or refreshes the mirror of url and finishes with its path, or None if the mirror
+        can't be used. It takes no lock. Manifest repos and include repos are unique by url, so the same url is never
+        mirrored twice at once."""
+        path = self.path_for(url)
+        if os.path.isdir(path):
+            msg = "Updating mirror of {0}...".format(url)
+            ret = yield Spawn(['git', '--git-dir=' + path, 'fetch', '--prune', '--quiet'])
+        else:
+            msg = "Mirroring {0}...".format(url)
+            if not os.path.isdir(self._root):
+                os.makedirs(self._root)
+            partial = path + '.partial'
+            if os.path.isdir(partial):
+                shutil.rmtree(partial)
+            ret = yield Spawn(['git', 'clone', '--mirror', '--quiet', url, partial])
+            if ret == 0:
+                os.rename(partial, path)
+        logger.info(msg + 'StatusCode:' + str(ret))
+        raise Return(None if ret and not os.path.isdir(path) else path)
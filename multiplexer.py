@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+import errno
+import math
+import os
+import select
+import sys
+import threading
+from collections import deque
+
+import snixLogger
+
+logger = snixLogger.SnixLogger.logger()
+
+TAIL_LINES = 40
+READ_SIZE = 1 << 16
+# How long the output of a process that exited is still waited for. Anything it started in the background, e.g.
+# `brew services start` or an ssh agent, inherits its pipes and can keep them open for as long as it runs.
+EXIT_GRACE = 0.2
+
+
+class _Poller:
+    """poll() where the platform has it, select() otherwise."""
+
+    def __init__(self):
+        self._poll = select.poll() if hasattr(select, 'poll') else None
+        self._fds = set()
+
+    def register(self, fd):
+        self._fds.add(fd)
+        if self._poll:
+            self._poll.register(fd, select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR)
+
+    def unregister(self, fd):
+        self._fds.discard(fd)
+        if self._poll:
+            self._poll.unregister(fd)
+
+    def poll(self, timeout=None):
+        """Returns the readable fds. timeout is in seconds, None waits forever."""
+        try:
+            if self._poll:
+                return [fd for fd, _ in self._poll.poll(None if timeout is None else int(math.ceil(timeout * 1000)))]
+            return select.select(list(self._fds), [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+class Channel:
+    """The output of one child process. Complete lines are written out prefixed with the channel name and the last
+    TAIL_LINES lines are kept for failure reports."""
+
+    def __init__(self, name, fds, out, on_close=None, capture_fd=None):
+        self.name = name
+        self.tail = deque(maxlen=TAIL_LINES)
+        self.captured = []
+        self.closed = threading.Event()
+        self._open = set(fds)
+        self._partial = dict((fd, '') for fd in fds)
+        self._prefix = "[{0}] ".format(name)
+        self._out = out
+        self._on_close = on_close
+        self._capture_fd = capture_fd
+
+    def feed(self, fd, data):
+        if fd == self._capture_fd:
+            self.captured.append(data)
+            return
+        lines = (self._partial[fd] + data.replace('\r', '\n')).split('\n')
+        self._partial[fd] = lines.pop()
+        self._emit(lines)
+
+    def close(self, fd):
+        partial = self._partial.pop(fd)
+        if fd != self._capture_fd:
+            self._emit([partial])
+        self._open.discard(fd)
+        if not self._open:
+            self.closed.set()
+            if self._on_close:
+                self._on_close(self)
+
+    def _emit(self, lines):
+        lines = [line for line in lines if line.strip()]
+        if lines:
+            self.tail.extend(lines)
+            self._out.write(''.join(self._prefix + line + '\n' for line in lines))
+            self._out.flush()
+
+
+class OutputMultiplexer:
+    """Streams stdout and stderr of any number of child processes through one poll loop on a background thread.
+    Pipes are read in large chunks, so output never blocks a child on a full pipe and never interleaves mid-line.
+    An unthreaded multiplexer does nothing until its owner calls iterate(), which is how the Engine drives it."""
+    instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get():
+        with OutputMultiplexer._instance_lock:
+            if OutputMultiplexer.instance is None:
+                OutputMultiplexer.instance = OutputMultiplexer(sys.stdout)
+            return OutputMultiplexer.instance
+
+    def __init__(self, out, threaded=True):
+        self._out = out
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._added = []
+        self._detached = []
+        self._poller = _Poller()
+        self._wake_r, self._wake_w = os.pipe()
+        self._poller.register(self._wake_r)
+        if threaded:
+            thread = threading.Thread(target=self._loop, name="snix-output")
+            thread.daemon = True
+            thread.start()
+
+    def watch(self, name, process, on_close=None, capture=False):
+        """Starts streaming a process started with stdout and stderr as pipes. Returns its Channel, which is closed
+        once both pipes reach EOF. With capture, stdout is collected in Channel.captured instead of being written."""
+        fds = [process.stdout.fileno(), process.stderr.fileno()]
+        channel = Channel(name, fds, self._out, on_close, fds[0] if capture else None)
+        with self._lock:
+            self._added.extend((fd, channel) for fd in fds)
+        self.wake()
+        return channel
+
+    def detach(self, channel):
+        """Stops streaming a channel and closes it, e.g. when its process was killed but children it left behind
+        still hold the pipes open."""
+        with self._lock:
+            self._detached.append(channel)
+        self.wake()
+
+    def wake(self):
+        os.write(self._wake_w, 'x')
+
+    def _loop(self):
+        while True:
+            self.iterate(None)
+
+    def iterate(self, timeout):
+        """Waits up to timeout seconds (None for ever) for output and dispatches whatever arrived."""
+        with self._lock:
+            added, self._added = self._added, []
+            detached, self._detached = self._detached, []
+        for fd, channel in added:
+            self._channels[fd] = channel
+            self._poller.register(fd)
+        for fd, channel in self._channels.items():
+            if channel in detached:
+                self._poller.unregister(fd)
+                del self._channels[fd]
+                channel.close(fd)
+        for fd in self._poller.poll(timeout):
+            if fd == self._wake_r:
+                os.read(self._wake_r, READ_SIZE)
+                continue
+            channel = self._channels.get(fd)
+            if channel is None:
+                continue
+            try:
+                data = os.read(fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                data = ''
+            if data:
+                channel.feed(fd, data)
+            else:
+                self._poller.unregister(fd)
+                del self._channels[fd]
+                channel.close(fd)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+import json
+import os
+import time
+from collections import OrderedDict
+
+import snixLogger
+from cache import write_atomically
+from item import InstalledIndex, Item
+from records import ItemRecord
+from snixCore import abort
+
+logger = snixLogger.SnixLogger.logger()
+
+PLAN_FORMAT = 2
+
+
+class Plan:
+    """What `snix run` will do, worked out without running anything.
+    A plan holds the merged manifest, what the install probe found and the resulting actions in order, with their
+    dependencies, lock domains and the amount of work each one has. Skipped items and includes that couldn't be read
+    offline are listed with the reason. Applying a plan rebuilds the same actions from the recorded manifest and probe,
+    so it doesn't need the manifest, its includes or the network."""
+
+    @staticmethod
+    def create(context, scheduler, installed, batch_size):
+        records = context.to_records()
+        plan = {'format': PLAN_FORMAT, 'created': time.time(), 'manifest': os.path.abspath(context.get_manifest_file()),
+                'batchSize': batch_size, 'records': records, 'selection': context.is_selection(),
+                'installed': installed.snapshot() if installed else None,
+                'actions': [Plan._action(task) for task in scheduler.ordered()],
+                'skipped': Plan._skipped(records, context, installed)}
+        return Plan(plan)
+
+    @staticmethod
+    def _action(task):
+        kind = task.task_id.split(':')[0]
+        return OrderedDict([('id', task.task_id), ('kind', kind), ('dependsOn', task.depends_on),
+                            ('lock', task.lock), ('work', len(task.provides) or 1)])
+
+    @staticmethod
+    def _skipped(records, context, installed):
+        skipped = []
+        for item in map(ItemRecord.from_json, records['items']):
+            version = installed.version(item.via, item.name) if installed else None
+            if version is not None:
+                skipped.append({'id': Item({'name': item.name, 'via': item.via}).task_id(),
+                                'reason': "version {0} is already installed".format(version)})
+        for include in context.get_unresolved():
+            skipped.append({'id': 'include:' + include, 'reason': 'not fetched yet and planned offline'})
+        return skipped
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path, 'r') as f:
+                plan = json.load(f)
+        except (IOError, ValueError) as e:
+            abort("Cannot read the plan {0}: {1}".format(path, e))
+        if plan.get('format') != PLAN_FORMAT:
+            abort("{0} is not a plan this version of snix can apply.".format(path))
+        return Plan(plan)
+
+    def __init__(self, plan):
+        self._plan = plan
+
+    def save(self, path):
+        write_atomically(path, self._plan)
+        logger.info("Wrote the plan for {0} actions to {1}".format(len(self._plan['actions']), path))
+
+    def manifest(self):
+        return self._plan['manifest']
+
+    def records(self):
+        return self._plan['records']
+
+    def batch_size(self):
+        return self._plan['batchSize']
+
+    def is_selection(self):
+        return self._plan.get('selection', False)
+
+    def installed(self):
+        return InstalledIndex.from_snapshot(self._plan['installed']) if self._plan['installed'] is not None else None
+
+    def actions(self):
+        return self._plan['actions']
+
+    def skipped(self):
+        return self._plan['skipped']
+
+    def unresolved(self):
+        return [entry['id'] for entry in self._plan['skipped'] if entry['id'].startswith('include:')]
+
+    def check(self, scheduler):
+        """Aborts unless the scheduler has exactly the actions of the plan."""
+        planned = [action['id'] for action in self._plan['actions']]
+        actual = [task.task_id for task in scheduler.ordered()]
+        if sorted(planned) != sorted(actual):
+            abort("The plan doesn't match what it describes. Planned {0}, got {1}.".format(planned, actual))
+
+    def __str__(self):
+        lines = ["Plan for {0}: {1} actions".format(self._plan['manifest'], len(self._plan['actions']))]
+        for action in self._plan['actions']:
+            lines.append("  {0} after {1}{2}".format(action['id'], ', '.join(action['dependsOn']) or 'nothing',
+                                                     " ({0} to install)".format(action['work'])
+                                                     if action['kind'] == 'items' else ''))
+        for entry in self._plan['skipped']:
+            lines.append("  skip {0}: {1}".format(entry['id'], entry['reason']))
+        return '\n'.join(lines)
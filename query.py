@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import fnmatch
+from collections import OrderedDict
+
+import snixLogger
+from download import file_name
+from repo import dir_name
+
+logger = snixLogger.SnixLogger.logger()
+
+SECTIONS = OrderedDict([('items', 'items'), ('repos', 'repos'), ('scripts', 'customScripts'),
+                        ('downloads', 'downloads')])
+GLOB_CHARS = '*?['
+
+
+def name_of(section, record):
+    """What --match is matched against: the item name, the repo's directory, the script path or the file name."""
+    if section == 'items':
+        return record.name
+    if section == 'repos':
+        return dir_name(record.key)
+    if section == 'customScripts':
+        return record.key
+    return file_name(record.key, record.entry.get('name'))
+
+
+def tags_of(section, record):
+    return record.tags if section == 'items' else record.tags()
+
+
+class ManifestIndex:
+    """Indexes the records of a merged manifest by section, via, name, tag and the include they came from, so a
+    selection is a few lookups rather than a pass over every entry. Only the matching records are turned into items,
+    repos and scripts."""
+
+    def __init__(self, records):
+        self._records = records
+        self._all = {}
+        self._via = {}
+        self._name = {}
+        self._tag = {}
+        self._source = {}
+        for section in SECTIONS.values():
+            positions = self._all[section] = set()
+            for position, record in enumerate(records[section]):
+                key = (section, position)
+                positions.add(key)
+                if section == 'items':
+                    self._via.setdefault(record.via, set()).add(key)
+                self._name.setdefault(name_of(section, record), set()).add(key)
+                for tag in tags_of(section, record):
+                    self._tag.setdefault(tag, set()).add(key)
+                self._source.setdefault(record.source, set()).add(key)
+
+    @staticmethod
+    def _lookup(index, patterns):
+        """The union of the entries under every key one of the patterns matches. Plain names are looked up directly."""
+        found = set()
+        for pattern in patterns:
+            if not any(char in pattern for char in GLOB_CHARS):
+                found.update(index.get(pattern, ()))
+                continue
+            for key, positions in index.items():
+                if fnmatch.fnmatchcase(key, pattern):
+                    found.update(positions)
+        return found
+
+    @staticmethod
+    def _from_include(source, pattern):
+        # An include is <repo>/<path>, and the path alone is enough, e.g. platform for groups/platform.
+        return fnmatch.fnmatchcase(source, pattern) or fnmatch.fnmatchcase(source.split('/', 1)[-1], pattern)
+
+    def select(self, sections=None, match=None, from_include=None, via=None, tag=None):
+        """Returns the records that satisfy every given selector. A selector is a list of values, any of which
+        matches. sections are the keys of SECTIONS."""
+        selected = set()
+        for section in sections or SECTIONS.keys():
+            selected.update(self._all[SECTIONS[section]])
+        if via:
+            selected &= self._lookup(self._via, via)
+        if match:
+            selected &= self._lookup(self._name, match)
+        if tag:
+            selected &= self._lookup(self._tag, tag)
+        if from_include:
+            found = set()
+            for pattern in from_include:
+                for source, positions in self._source.items():
+                    if self._from_include(source, pattern):
+                        found.update(positions)
+            selected &= found
+        records = dict((section, []) for section in SECTIONS.values())
+        for section, position in sorted(selected):
+            records[section].append(self._records[section][position])
+        return records
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+import json
+
+from snixCore import abort
+
+_strings = {}
+
+
+def intern_string(value):
+    """Returns the one shared copy of value. A large manifest repeats the same vias, sources and names many times,
+    and intern() doesn't take unicode on Python 2."""
+    return _strings.setdefault(value, value)
+
+
+def load_json(path, stream=False):
+    """Reads a JSON file. With stream, the file is parsed incrementally with ijson rather than read into memory in
+    full first, which keeps the peak memory of huge generated manifests down."""
+    with open(path, 'rb') as f:
+        if not stream:
+            return json.load(f)
+        try:
+            import ijson
+        except ImportError:
+            abort("Parsing manifests incrementally needs ijson. Install it with `pip install ijson`.")
+        return next(ijson.items(f, ''))
+
+
+class ItemRecord(object):
+    """An item of the merged manifest, i.e. one name and its via, and the manifest it came from."""
+    __slots__ = ('name', 'via', 'source', 'tags')
+
+    def __init__(self, name, via, source, tags=None):
+        self.name = intern_string(name)
+        self.via = intern_string(via)
+        self.source = intern_string(source)
+        self.tags = tuple(intern_string(tag) for tag in tags) if tags else ()
+
+    def to_json(self):
+        """A [name, via, source] row, with the tags last if there are any. Rows take a fraction of the memory and
+        space dicts would for the tens of thousands of items a manifest can have."""
+        row = [self.name, self.via, self.source]
+        if self.tags:
+            row.append(list(self.tags))
+        return row
+
+    @staticmethod
+    def from_json(row):
+        return ItemRecord(*row)
+
+
+class EntryRecord(object):
+    """A repo, script or download of the merged manifest: its key, the entry as the manifest has it and the manifest
+    it came from. KEY is what the key is called in to_json."""
+    __slots__ = ('key', 'entry', 'source')
+    KEY = None
+
+    def __init__(self, key, entry, source):
+        self.key = key
+        self.entry = entry
+        self.source = intern_string(source)
+
+    def tags(self):
+        return self.entry.get('tags', ()) if type(self.entry) is dict else ()
+
+    def to_json(self):
+        return {self.KEY: self.key, 'entry': self.entry, 'source': self.source}
+
+    @classmethod
+    def from_json(cls, record):
+        return cls(record[cls.KEY], record['entry'], record['source'])
+
+
+class RepoRecord(EntryRecord):
+    __slots__ = ()
+    KEY = 'url'
+
+
+class ScriptRecord(EntryRecord):
+    __slots__ = ()
+    KEY = 'path'
+
+
+class DownloadRecord(EntryRecord):
+    __slots__ = ()
+    KEY = 'url'
+
+
+class RecordTable(object):
+    """Records by key in the order the keys were first added. Replacing a record keeps its place, the way an
+    OrderedDict does, without the linked list node an OrderedDict keeps per key on Python 2."""
+    __slots__ = ('_positions', '_records')
+
+    def __init__(self):
+        self._positions = {}
+        self._records = []
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __getitem__(self, key):
+        return self._records[self._positions[key]]
+
+    def __setitem__(self, key, record):
+        position = self._positions.get(key)
+        if position is None:
+            self._positions[key] = len(self._records)
+            self._records.append(record)
+        else:
+            self._records[position] = record
+
+    def __len__(self):
+        return len(self._records)
+
+    def values(self):
+        return list(self._records)
+
+    def clear(self):
+        self._positions.clear()
+        del self._records[:]
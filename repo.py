@@ -1,12 +1,81 @@
 #!/usr/bin/env python
-import shlex
+import os
+import re
+import threading
 
-from snixCore import execute, execute_in_dir_and_revert, abort
+from engine import Spawn, Return, drive
+from snixCore import ExecutionContext, abort
+from mirror import MirrorCache
 import snixLogger
 
 logger = snixLogger.SnixLogger.logger()
 
 
+def normalize_url(url):
+    """Reduces the ways of spelling a repo URL to one key, e.g. git@github.com:org/x.git and
+    https://github.com/org/x both become github.com/org/x."""
+    url = url.strip().rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-len('.git')]
+    if url.startswith('file://'):
+        return url[len('file://'):]
+    match = re.match(r'^(?:[\w+.-]+://)?(?:[^@/]+@)?([^:/]+)(?::\d+)?[:/](.*)$', url)
+    if match and not url.startswith('/'):
+        return match.group(1).lower() + '/' + match.group(2)
+    return url
+
+
+def host_of(url):
+    """The host a repo is fetched from, or localhost for a path or file:// URL."""
+    normalized = normalize_url(url)
+    return 'localhost' if normalized.startswith('/') else normalized.split('/')[0]
+
+
+class Updates:
+    """Settings shared by every repo in the process: whether a checkout that already exists is fast-forwarded once
+    it's fetched and how many clones and fetches can talk to one host at the same time. Also collects the checkouts
+    that were moved by an update."""
+
+    def __init__(self, fast_forward=False, per_host=4):
+        self.fast_forward = fast_forward
+        self.per_host = max(1, per_host)
+        self._lock = threading.Lock()
+        self._changed = []
+
+    def record(self, name, before, after):
+        with self._lock:
+            self._changed.append((name, before, after))
+
+    def changed(self):
+        """(directory, HEAD before, HEAD after) of every checkout whose refs an update moved, in the order they
+        finished."""
+        with self._lock:
+            return list(self._changed)
+
+
+updates = Updates()
+
+
+def configure(fast_forward=False, per_host=4):
+    """Sets the process wide update settings."""
+    updates.fast_forward = fast_forward
+    updates.per_host = max(1, per_host)
+
+
+def _refs(out):
+    """ref -> sha from the output of `git show-ref --head`."""
+    refs = {}
+    for line in out.splitlines():
+        sha, _, ref = line.partition(' ')
+        refs[ref] = sha
+    return refs
+
+
+def dir_name(url):
+    """The directory a repo is cloned into, e.g. x for git@github.com:org/x.git."""
+    return url.rstrip('/').split('/')[-1].split(':')[-1].split('.')[0]
+
+
 class Repo:
     """Represents a repository."""
 
@@ -16,13 +85,108 @@ class Repo:
         self._context = context
 
     def clone(self):
-        with execute_in_dir_and_revert(self._context['snix_root']):
-            msg = "Cloning {0}...".format(self._context['repo_location'])
-            cmd, use_shell = self._build_cmd()
-            logger.info(msg + cmd)
-            ret = execute(shlex.split(cmd), use_shell)
-            logger.info(msg + 'StatusCode:' + str(ret))
-            logger.info(msg + 'Done!')
-
-    def _build_cmd(self):
-        return "git clone --progress " + self._context['repo_location'], False
+        return drive(self.clone_async())
+
+    def clone_async(self):
+        if os.path.exists(os.path.join(self._working_copy(), '.git')):
+            ret = yield self.update_async()
+            raise Return(ret)
+        msg = "Cloning {0}...".format(self._context['repo_location'])
+        mirror = None
+        if self._uses_mirror():
+            mirror = yield MirrorCache(self._context['snix_root']).ensure_async(self._context['repo_location'])
+        ret = 0
+        for cmd, cwd in self._build_cmds(mirror):
+            logger.info(msg + ' '.join(cmd))
+            ret = yield Spawn(cmd, context=ExecutionContext(cwd))
+            if ret:
+                break
+        logger.info(msg + 'StatusCode:' + str(ret))
+        logger.info(msg + 'Done!')
+        raise Return(ret)
+
+    def update_async(self):
+        """Coroutine that fetches a checkout that already exists and, if asked to, fast-forwards its branch. Whether
+        the fetch or the fast-forward moved any ref is recorded in updates."""
+        msg = "Updating {0}...".format(self.dir_name())
+        context = ExecutionContext(self._working_copy())
+        _, before = yield Spawn(['git', 'show-ref', '--head'], context=context, capture=True)
+        fetch = ['git', 'fetch', '--prune', '--quiet', 'origin']
+        if 'depth' in self._options():
+            # Keeps a shallow clone shallow instead of fetching the whole history.
+            fetch += ['--depth', str(self._options()['depth'])]
+        logger.info(msg + ' '.join(fetch))
+        ret = yield Spawn(fetch, context=context)
+        if ret == 0 and self._context.get('fast_forward', updates.fast_forward):
+            merge = ['git', 'merge', '--ff-only', '--quiet', '@{u}']
+            logger.info(msg + ' '.join(merge))
+            ret = yield Spawn(merge, context=context)
+        _, after = yield Spawn(['git', 'show-ref', '--head'], context=context, capture=True)
+        if after != before:
+            before, after = _refs(before).get('HEAD'), _refs(after).get('HEAD')
+            updates.record(self.dir_name(), before, after)
+            if before != after:
+                logger.info(msg + "HEAD moved from {0} to {1}.".format((before or 'no commit')[:12],
+                                                                       (after or 'no commit')[:12]))
+            else:
+                logger.info(msg + "Fetched new commits. HEAD is still at {0}.".format((after or 'no commit')[:12]))
+        else:
+            logger.info(msg + "Already up to date.")
+        logger.info(msg + 'StatusCode:' + str(ret))
+        raise Return(ret)
+
+    def url(self):
+        return self._context['repo_location']
+
+    def dir_name(self):
+        return dir_name(self._context['repo_location'])
+
+    def task_id(self):
+        return "repo:" + self.dir_name()
+
+    def lock_domain(self):
+        """Clones and fetches from the same host share a lock domain, which the scheduler caps at updates.per_host
+        at a time."""
+        return 'host:' + host_of(self._context['repo_location'])
+
+    def _working_copy(self):
+        return os.path.join(self._context['snix_root'], self.dir_name())
+
+    def inputs(self):
+        return {'url': self._context['repo_location'], 'options': self._options()}
+
+    def _options(self):
+        return self._context.get('clone_options', {})
+
+    def _uses_mirror(self):
+        # Shallow and partial clones exist to avoid transferring the full history, which is what a mirror holds.
+        return 'depth' not in self._options() and 'filter' not in self._options()
+
+    def _build_cmds(self, mirror=None):
+        """Returns the (command, working directory) pairs that produce the working copy."""
+        snix_root = self._context['snix_root']
+        working_copy = self._working_copy()
+        url = self._context['repo_location']
+        options = self._options()
+
+        clone = ['git', 'clone', '--progress']
+        if 'depth' in options:
+            clone += ['--depth', str(options['depth'])]
+        if 'filter' in options:
+            clone += ['--filter=' + options['filter']]
+        if options.get('singleBranch'):
+            clone += ['--single-branch']
+        if 'branch' in options:
+            clone += ['--branch', options['branch']]
+        if options.get('sparse'):
+            clone += ['--sparse']
+
+        if mirror:
+            # A local clone hardlinks the mirror's objects. Point origin back upstream afterwards.
+            cmds = [(clone + [mirror, self.dir_name()], snix_root),
+                    (['git', 'remote', 'set-url', 'origin', url], working_copy)]
+        else:
+            cmds = [(clone + [url, self.dir_name()], snix_root)]
+        if options.get('sparse'):
+            cmds.append((['git', 'sparse-checkout', 'set'] + options['sparse'], working_copy))
+        return cmds
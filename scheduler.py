@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+import os
+import threading
+import Queue
+from collections import OrderedDict
+
+import snixLogger
+from item import InstalledIndex
+from repo import updates
+from snixCore import abort, current_task
+from tracing import tracer
+
+logger = snixLogger.SnixLogger.logger()
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Task:
+    """A node in the execution graph. The action is a callable that returns a status code, 0 being success, and
+    async_action returns the equivalent coroutine for the Engine. Tasks that share a lock are never run at the same
+    time, unless the scheduler allows more for that lock. inputs returns what the action was asked to do, which the
+    journal hashes to tell whether it changed."""
+
+    def __init__(self, task_id, action, depends_on=None, lock=None, provides=None, async_action=None, inputs=None):
+        self.task_id = task_id
+        self.action = action
+        self.async_action = async_action
+        self.inputs = inputs or (lambda: {})
+        self.depends_on = list(OrderedDict.fromkeys(depends_on or []))
+        self.lock = lock
+        self.provides = provides or []
+        self.status = None
+
+    def __str__(self):
+        return self.task_id
+
+
+class Scheduler:
+    """Runs a graph of tasks on a bounded pool of worker threads.
+    A task is started as soon as everything it depends on has succeeded. Dependents of a failed task are skipped."""
+
+    @staticmethod
+    def from_context(context, jobs=1, batch_size=1, installed=None):
+        scheduler = Scheduler(jobs)
+        scheduler._partial = context.is_selection()
+        if installed:
+            for via in context.get_vias():
+                scheduler._satisfied[via] = installed.names(via)
+        item_ids = []
+        for batch in context.get_item_batches(batch_size, installed):
+            task = Task(batch.task_id(), batch.install, lock=batch.lock_domain(), provides=batch.names(),
+                        async_action=batch.install_async, inputs=batch.inputs)
+            scheduler.add(task)
+            item_ids.append(task.task_id)
+
+        download_ids = []
+        for download in context.get_downloads():
+            task = Task(download.task_id(), download.fetch, async_action=download.fetch_async,
+                        inputs=download.inputs)
+            scheduler.add(task)
+            download_ids.append(task.task_id)
+
+        repo_ids = {}
+        for repo in context.get_repos():
+            task = Task(repo.task_id(), repo.clone, lock=repo.lock_domain(), async_action=repo.clone_async,
+                        inputs=repo.inputs)
+            scheduler.add(task)
+            scheduler.limit(task.lock, updates.per_host)
+            repo_ids[repo.dir_name()] = task.task_id
+
+        previous_script = None
+        for script in context.get_custom_scripts():
+            explicit = script.depends_on()
+            if explicit:
+                depends_on = [task_id for task_id in map(scheduler.resolve, explicit) if task_id]
+            else:
+                # No declared dependencies: the script may need any item or download and runs after the scripts
+                # before it.
+                depends_on = item_ids + download_ids
+                if previous_script:
+                    depends_on.append(previous_script)
+            owner = script.location().split(os.sep)[0]
+            if owner in repo_ids:
+                depends_on.append(repo_ids[owner])
+            task = Task(script.task_id(), script.execute, depends_on, async_action=script.execute_async,
+                        inputs=script.inputs)
+            scheduler.add(task)
+            previous_script = task.task_id
+        return scheduler
+
+    def __init__(self, jobs=1):
+        self._jobs = max(1, jobs)
+        self._tasks = OrderedDict()
+        self._satisfied = {}
+        self._partial = False
+        self._capacity = {}
+
+    def add(self, task):
+        if task.task_id in self._tasks:
+            abort("{0} is scheduled twice. Two entries of the manifest would overwrite each other.".format(task.task_id))
+        self._tasks[task.task_id] = task
+
+    def limit(self, lock, count):
+        """Lets up to count tasks that share the lock run at the same time, e.g. fetches from one host."""
+        self._capacity[lock] = max(1, count)
+
+    def resolve(self, name):
+        """Finds the task for a dependency declared in a manifest. Accepts a task id or the bare name of an item,
+        a repo or a script. Returns None for an item that is already installed or, when only part of the manifest was
+        selected, for anything outside the selection."""
+        if name in self._tasks:
+            return name
+        for task_id, task in self._tasks.items():
+            if task_id.split(':')[-1] == name or name in task.provides:
+                return task_id
+        if any(InstalledIndex.normalize(via, name) in names for via, names in self._satisfied.items()):
+            return None
+        if self._partial:
+            logger.info("{0} is not part of the selection. Assuming it is done.".format(name))
+            return None
+        abort("Cannot resolve dependency {0}. It is not an item, repo or script in this manifest.".format(name))
+
+    def tasks(self):
+        return self._tasks.values()
+
+    def ordered(self):
+        """Returns the tasks in an order that satisfies every dependency. Aborts if the graph has a cycle."""
+        ordered = []
+        state = {}
+
+        def _visit(task_id, path):
+            if state.get(task_id) == 'done':
+                return
+            if state.get(task_id) == 'visiting':
+                cycle = path[path.index(task_id):] + [task_id]
+                abort("Dependency cycle detected: {0}".format(' -> '.join(cycle)))
+            if task_id not in self._tasks:
+                abort("{0} depends on {1} which is not scheduled.".format(path[-1], task_id))
+            state[task_id] = 'visiting'
+            for dependency in self._tasks[task_id].depends_on:
+                _visit(dependency, path + [task_id])
+            state[task_id] = 'done'
+            ordered.append(self._tasks[task_id])
+
+        for task_id in self._tasks:
+            _visit(task_id, [])
+        return ordered
+
+    def run(self, executor=None, journal=None):
+        """Executes every task and returns a dict of task id to status. Tasks run on a ThreadPool of `jobs` threads
+        unless another executor is given. With a journal, every start and outcome is recorded in it and tasks that
+        the journal has as completed, along with everything they depend on, are not run again."""
+        ordered = self.ordered()
+        resumed = set()
+        if journal:
+            for task in ordered:
+                if all(dependency in resumed for dependency in task.depends_on) and journal.completed(task):
+                    task.status = SUCCEEDED
+                    resumed.add(task.task_id)
+            if resumed:
+                logger.info("Resuming. {0} of {1} actions already succeeded.".format(len(resumed), len(ordered)))
+        dependents = dict((task.task_id, []) for task in ordered)
+        waiting_on = {}
+        for task in ordered:
+            waiting_on[task.task_id] = set(task.depends_on) - resumed
+            for dependency in task.depends_on:
+                dependents[dependency].append(task.task_id)
+
+        executor = executor or ThreadPool(min(self._jobs, len(ordered)))
+        ready = [task for task in ordered if task.status is None and not waiting_on[task.task_id]]
+        held_locks = {}
+        in_flight = 0
+        remaining = len(ordered) - len(resumed)
+        try:
+            while remaining:
+                for task in list(ready):
+                    if in_flight >= self._jobs:
+                        break
+                    if task.lock and held_locks.get(task.lock, 0) >= self._capacity.get(task.lock, 1):
+                        continue
+                    ready.remove(task)
+                    if task.lock:
+                        held_locks[task.lock] = held_locks.get(task.lock, 0) + 1
+                    in_flight += 1
+                    if journal:
+                        journal.started(task)
+                    executor.submit(task)
+
+                task, ret = executor.wait()
+                in_flight -= 1
+                remaining -= 1
+                if task.lock:
+                    held_locks[task.lock] -= 1
+                task.status = SUCCEEDED if not ret else FAILED
+                if journal:
+                    journal.finished(task)
+                if task.status == SUCCEEDED:
+                    for dependent in dependents[task.task_id]:
+                        waiting_on[dependent].discard(task.task_id)
+                        if not waiting_on[dependent] and self._tasks[dependent].status is None:
+                            ready.append(self._tasks[dependent])
+                else:
+                    skipped = self._skip_dependents(task, dependents)
+                    remaining -= len(skipped)
+                    for skipped_task in skipped if journal else []:
+                        journal.finished(skipped_task)
+        finally:
+            executor.shutdown()
+        return OrderedDict((task.task_id, task.status) for task in ordered)
+
+    def _skip_dependents(self, task, dependents):
+        """Marks everything that depends on the failed task as skipped and returns those tasks."""
+        skipped = []
+        for dependent in dependents[task.task_id]:
+            dependent_task = self._tasks[dependent]
+            if dependent_task.status is None:
+                logger.warn("Skipping {0} because {1} {2}.".format(dependent, task.task_id, task.status))
+                dependent_task.status = SKIPPED
+                skipped.append(dependent_task)
+                skipped.extend(self._skip_dependents(dependent_task, dependents))
+        return skipped
+
+
+class ThreadPool:
+    """Runs task actions on a fixed number of worker threads."""
+
+    def __init__(self, size):
+        self._work = Queue.Queue()
+        self._done = Queue.Queue()
+        self._workers = [threading.Thread(target=self._run, name="snix-worker-%d" % i) for i in range(size)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, task):
+        self._work.put(task)
+
+    def wait(self):
+        """Returns (task, status code) for the next task to finish."""
+        # A timeout keeps the main thread responsive to Ctrl-C while the workers are busy.
+        while True:
+            try:
+                return self._done.get(timeout=0.5)
+            except Queue.Empty:
+                pass
+
+    def shutdown(self):
+        for _ in self._workers:
+            self._work.put(None)
+
+    def _run(self):
+        while True:
+            task = self._work.get()
+            if task is None:
+                return
+            current_task.name = task.task_id
+            with tracer.span(task.task_id) as span:
+                try:
+                    ret = task.action()
+                except (Exception, SystemExit) as e:
+                    logger.error("{0} raised {1}".format(task.task_id, e))
+                    ret = 1
+                span.set(status=ret)
+            self._done.put((task, ret))
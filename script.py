@@ -1,15 +1,23 @@
 #!/usr/bin/env python
+import glob
 import os
 import shlex
+from collections import OrderedDict
 
-from snixCore import execute, execute_in_dir_and_revert, abort
+import backends
+from cache import ScriptCache, digest, file_hash
+from engine import Call, Spawn, Return, drive
+from item import InstalledIndex
+from snixCore import ExecutionContext, abort
 import snixLogger
 
 logger = snixLogger.SnixLogger.logger()
 
 
 class Script:
-    """Represents an executable script."""
+    """Represents an executable script.
+    A script that declares its inputs is memoized: it is skipped while the inputs are unchanged and its outputs
+    exist."""
 
     def __init__(self, context):
         if not type(context) is dict:
@@ -17,13 +25,87 @@ class Script:
         self._context = context
 
     def execute(self):
+        return drive(self.execute_async())
+
+    def execute_async(self):
         script_path=os.path.join(self._context['snix_root'],self._context['script_location'])
         if not os.access(script_path, os.X_OK):
             abort(script_path+"is not executable!")
-        with execute_in_dir_and_revert(os.path.split(script_path)[0]):
-            msg = "Executing {0}...".format(script_path)
-            logger.info(msg + script_path)
-            ret = execute(shlex.split(script_path), True)
-            logger.info(msg + 'StatusCode:' + str(ret))
-            logger.info(msg + 'Done!')
+        msg = "Executing {0}...".format(script_path)
+        memoized = self._context.get('inputs') is not None
+        if memoized:
+            cache = ScriptCache(self._context['snix_root'])
+            entry = yield Call(cache.load, self.location())
+            fingerprint, files = yield self._fingerprint(entry.get('files', {}))
+            if cache.up_to_date(entry, fingerprint, self.outputs()):
+                logger.info(msg + "Skipped. Its inputs are unchanged and its outputs exist.")
+                raise Return(0)
+        logger.info(msg + script_path)
+        context = ExecutionContext(os.path.split(script_path)[0], self._context.get('env'), self._context.get('umask'))
+        ret = yield Spawn(shlex.split(script_path), True, context)
+        if memoized and ret == 0:
+            yield Call(cache.store, self.location(), fingerprint, files)
+        logger.info(msg + 'StatusCode:' + str(ret))
+        logger.info(msg + 'Done!')
+        raise Return(ret)
+
+    def _path(self, path):
+        return os.path.join(self._context['snix_root'], os.path.expanduser(path))
+
+    def outputs(self):
+        """Where the declared outputs are, empty for a script that isn't memoized."""
+        return [self._path(output) for output in self._context.get('outputs', [])]
+
+    def _input_files(self):
+        """The declared input files, with globs expanded and directories walked, and the patterns matching nothing."""
+        paths = [self._path(self._context['script_location'])]
+        missing = []
+        for pattern in self._context['inputs'].get('files', []):
+            matches = sorted(glob.glob(self._path(pattern)))
+            if not matches:
+                missing.append(pattern)
+            for match in matches:
+                if os.path.isdir(match):
+                    for root, dirs, names in os.walk(match):
+                        dirs.sort()
+                        paths.extend(os.path.join(root, name) for name in sorted(names))
+                else:
+                    paths.append(match)
+        return list(OrderedDict.fromkeys(paths)), missing
+
+    def _fingerprint(self, previous_files):
+        """Coroutine that finishes with the hash of the declared inputs, i.e. the content of the script and the input
+        files, the environment variables and the installed versions of the items, and the state of the files."""
+        inputs = self._context['inputs']
+        names_by_via = OrderedDict()
+        for item in inputs.get('items', []):
+            via, name = item.split(':', 1)
+            names_by_via.setdefault(via, []).append(name)
+        versions = {}
+        for via, names in names_by_via.items():
+            installed = yield backends.get(via).list_installed(self._context, names)
+            installed = InstalledIndex.normalized(via, installed)
+            for name in names:
+                versions[via + ':' + name] = installed.get(InstalledIndex.normalize(via, name))
+        paths, missing = self._input_files()
+        files = yield Call(ScriptCache.hash_files, paths, previous_files)
+        env = dict(os.environ, **self._context.get('env', {}))
+        raise Return((digest({'files': dict((path, state['sha256']) for path, state in files.items()),
+                              'missing': missing, 'items': versions,
+                              'env': dict((var, env.get(var)) for var in inputs.get('env', []))}), files))
+
+    def location(self):
+        return self._context['script_location']
+
+    def depends_on(self):
+        return self._context.get('depends_on', [])
+
+    def task_id(self):
+        return "script:" + self.location()
 
+    def inputs(self):
+        """The script's content counts, so an edited script runs again when a run is resumed."""
+        script_path = os.path.join(self._context['snix_root'], self._context['script_location'])
+        return {'script': self.location(), 'sha256': file_hash(script_path) if os.path.isfile(script_path) else None,
+                'env': self._context.get('env'), 'umask': self._context.get('umask'),
+                'inputs': self._context.get('inputs'), 'outputs': self._context.get('outputs')}
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+import json
+import os
+import time
+
+import backends
+import snixLogger
+from cache import write_atomically
+from engine import drive
+from item import InstalledIndex
+from repo import normalize_url
+
+logger = snixLogger.SnixLogger.logger()
+
+SNAPSHOT_FILE = os.path.join('.cache', 'snapshot.json')
+SNAPSHOT_FORMAT = 3
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def git_dir_of(checkout):
+    """The git directory of a working copy, following the `gitdir:` file of worktrees and submodules."""
+    git = os.path.join(checkout, '.git')
+    if os.path.isfile(git):
+        target = (_read(git) or '').strip()
+        if target.startswith('gitdir: '):
+            return os.path.join(checkout, target[len('gitdir: '):])
+    return git
+
+
+def read_head(git_dir):
+    """Returns (ref, sha) of HEAD, reading git's files rather than running git. ref is None for a detached HEAD."""
+    head = (_read(os.path.join(git_dir, 'HEAD')) or '').strip()
+    if not head.startswith('ref: '):
+        return None, head or None
+    ref = head[len('ref: '):]
+    sha = _read(os.path.join(git_dir, ref))
+    if sha:
+        return ref, sha.strip()
+    for line in (_read(os.path.join(git_dir, 'packed-refs')) or '').splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1] == ref:
+            return ref, fields[0]
+    return ref, None
+
+
+def read_origin(git_dir):
+    """The url of the origin remote from the repo's config."""
+    in_origin = False
+    for line in (_read(os.path.join(git_dir, 'config')) or '').splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            in_origin = line.replace(' ', '') == '[remote"origin"]'
+        elif in_origin and line.split('=')[0].strip() == 'url':
+            return line.split('=', 1)[1].strip()
+    return None
+
+
+class Snapshot:
+    """An index of what this machine has, kept in <snix home>/.cache/snapshot.json: what each backend has installed
+    and which of that was installed on request rather than as a dependency, the git checkouts directly under the snix home with their HEAD and origin, and the outputs of memoized scripts.
+    Refreshing it only reads again what changed. A backend is listed again only when the mtime of its package
+    database moved, and a checkout is read again only when its HEAD, config or refs did."""
+
+    def __init__(self, snix_home):
+        self._home = snix_home
+        self._path = os.path.join(snix_home, SNAPSHOT_FILE)
+        self._data = self._load()
+        self._rescanned = []
+
+    def _load(self):
+        data = {}
+        raw = _read(self._path)
+        if raw:
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                logger.warn("{0} is corrupt. Taking a new snapshot.".format(self._path))
+        if data.get('format') != SNAPSHOT_FORMAT:
+            data = {'format': SNAPSHOT_FORMAT}
+        for section in ('installed', 'repos', 'outputs'):
+            data.setdefault(section, {})
+        return data
+
+    def refresh(self, vias, scripts):
+        """Brings the index up to date for the given backends, every checkout and the outputs of the scripts."""
+        for via in vias:
+            self._refresh_installed(via)
+        self._refresh_repos()
+        self._data['outputs'] = dict((script.location(), dict((path, _mtime(path)) for path in script.outputs()))
+                                     for script in scripts if script.outputs())
+        self._data['created'] = time.time()
+        return self
+
+    def _refresh_installed(self, via):
+        backend = backends.get(via)
+        context = {'via': via, 'snix_root': self._home}
+        stamp = [[path, _mtime(path)] for path in backend.state_paths(context) if os.path.exists(path)]
+        recorded = self._data['installed'].get(via)
+        if stamp and recorded and recorded['stamp'] == stamp:
+            return
+        self._rescanned.append('installed:' + via)
+        versions = InstalledIndex.normalized(via, drive(backend.list_installed(context, ())))
+        explicit = versions.keys()
+        if backend.explicit_cmd() is not None:
+            explicit = [InstalledIndex.normalize(via, name) for name in drive(backend.list_explicit(context))]
+        self._data['installed'][via] = {'stamp': stamp, 'versions': versions, 'explicit': sorted(set(explicit))}
+
+    def _refresh_repos(self):
+        repos = {}
+        for name in sorted(os.listdir(self._home)) if os.path.isdir(self._home) else []:
+            checkout = os.path.join(self._home, name)
+            if name.startswith('.') or not os.path.exists(os.path.join(checkout, '.git')):
+                continue
+            git_dir = git_dir_of(checkout)
+            recorded = self._data['repos'].get(name)
+            stamp = [_mtime(os.path.join(git_dir, path)) for path in
+                     ('HEAD', 'config', 'packed-refs', recorded['ref'] if recorded and recorded['ref'] else 'HEAD')]
+            if recorded and recorded['stamp'] == stamp:
+                repos[name] = recorded
+                continue
+            self._rescanned.append('repo:' + name)
+            ref, head = read_head(git_dir)
+            # The branch may have changed, and the stamp has to cover the file of the one checked out now.
+            stamp[3] = _mtime(os.path.join(git_dir, ref or 'HEAD'))
+            repos[name] = {'ref': ref, 'head': head, 'origin': read_origin(git_dir), 'stamp': stamp}
+        self._data['repos'] = repos
+
+    def rescanned(self):
+        """What the last refresh had to read again."""
+        return self._rescanned
+
+    def save(self):
+        write_atomically(self._path, self._data)
+
+    def installed(self):
+        return InstalledIndex.from_snapshot(dict((via, recorded['versions'])
+                                                 for via, recorded in self._data['installed'].items()))
+
+    def explicit(self, via):
+        """The names installed via via on request. Dependencies they pulled in are left out."""
+        return self._data['installed'].get(via, {}).get('explicit', [])
+
+    def repos(self):
+        return self._data['repos']
+
+    def drift(self, context):
+        """Returns one line per difference between the manifest of context and the snapshot. Lines start with - for
+        what the manifest has and the machine doesn't, + for the reverse and ~ for what differs."""
+        lines = []
+        installed = self.installed()
+        wanted = set()
+        for item in context.get_items():
+            wanted.add((item.via(), InstalledIndex.normalize(item.via(), item.name())))
+            if not installed.is_installed(item.via(), item.name()):
+                lines.append("- item {0} via {1} is not installed".format(item.name(), item.via()))
+        for via in context.get_vias():
+            # Only what was installed on request. Dependencies are up to the package manager.
+            for name in self.explicit(via):
+                if (via, name) not in wanted:
+                    lines.append("+ item {0} via {1} is installed but not in the manifest".format(name, via))
+
+        repos = self.repos()
+        # Include repos are checked out next to the others. They are part of the manifest too.
+        expected = set(source.split('/')[0] for source in context.get_sources() if source != 'root')
+        for repo in context.get_repos():
+            name = repo.dir_name()
+            expected.add(name)
+            recorded = repos.get(name)
+            if recorded is None:
+                lines.append("- repo {0} is not cloned".format(name))
+            elif recorded['origin'] and normalize_url(recorded['origin']) != normalize_url(repo.url()):
+                lines.append("~ repo {0} is cloned from {1}, the manifest has {2}".format(
+                    name, recorded['origin'], repo.url()))
+        for name in sorted(set(repos) - expected):
+            lines.append("+ repo {0} is cloned but not in the manifest".format(name))
+
+        for script in context.get_custom_scripts():
+            for path in script.outputs():
+                if self._data['outputs'].get(script.location(), {}).get(path) is None:
+                    lines.append("- output {0} of {1} is missing".format(
+                        os.path.relpath(path, self._home), script.location()))
+        return lines
+
+    def __str__(self):
+        installed = self._data['installed']
+        lines = ["Snapshot of {0}:".format(self._home)]
+        for via in sorted(installed):
+            lines.append("  {0} items installed via {1}, {2} of them on request".format(
+                len(installed[via]['versions']), via, len(installed[via]['explicit'])))
+        for name, recorded in sorted(self._data['repos'].items()):
+            lines.append("  repo {0} at {1} ({2})".format(name, (recorded['head'] or 'no commit')[:12],
+                                                           (recorded['ref'] or 'detached').split('/')[-1]))
+        for location, outputs in sorted(self._data['outputs'].items()):
+            lines.append("  {0}: {1} of {2} outputs exist".format(
+                location, len([mtime for mtime in outputs.values() if mtime is not None]), len(outputs)))
+        return '\n'.join(lines)
@@ -1,108 +1,272 @@
 #!/usr/bin/env python
 import json
 import os
+import backends
 import singleton
 import snixCore
-from jsonschema import Draft4Validator
-from item import Item
-from repo import Repo
+import snixLogger
+from collections import OrderedDict
+from cache import ManifestCache
+from download import Download, file_name
+from item import Item, ItemBatch, InstalledIndex
+from includes import IncludeResolver
+from query import ManifestIndex
+from records import ItemRecord, RepoRecord, ScriptRecord, DownloadRecord, RecordTable, load_json
+from repo import Repo, dir_name, normalize_url
 from script import Script
+from tracing import tracer
+from validation import ManifestValidator, SCHEMA_FILE
 import ConfigParser
 
+logger = snixLogger.SnixLogger.logger()
+
 
 class snixContext:
-    """A parser that will build an in-memory representation of a snix manifest."""
+    """A parser that will build an in-memory representation of a snix manifest.
+    The merged manifest is kept as compact records. Items, repos and scripts are only created as they're iterated."""
     __metaclass__ = singleton.Singleton
 
     @staticmethod
-    def construct_from(manifest_file):
-        sc = snixContext(manifest_file)
-        sc._construct()
+    def construct_from(manifest_file, use_cache=True, jobs=1, offline=False, stream=False, update_includes=False):
+        if not os.path.isfile(manifest_file):
+            snixCore.abort("%s is not a valid file path!" % manifest_file)
+        sc = snixContext(manifest_file, jobs)
+        sc._construct(use_cache, offline, stream, update_includes)
+        sc._check_collisions()
+        return sc
+
+    @staticmethod
+    def from_records(manifest_file, records, jobs=1, selection=False):
+        """Rebuilds a context from to_records() without reading the manifest or its includes. selection says whether
+        the records are only part of the manifest."""
+        sc = snixContext(manifest_file, jobs)
+        sc._snix_home = sc._read_home()
+        sc._load(records)
+        sc._check_collisions()
+        sc._selected = selection
         return sc
 
-    def __init__(self, _file):
-        if not os.path.isfile(_file):
-            snixCore.abort("%s is not a valid file path!" % _file)
+    def __init__(self, _file, jobs=1):
         self._file = _file
-        self._manifest_items = []
-        self._manifest_repos = []
-        self._manifest_custom_scripts = []
+        self._manifest_items = RecordTable()
+        self._manifest_repos = RecordTable()
+        self._manifest_custom_scripts = RecordTable()
+        self._manifest_downloads = RecordTable()
+        self._duplicates = OrderedDict()
+        self._snix_home = None
+        self._inputs = []
+        self._unresolved = []
+        self._jobs = jobs
+        self._selected = False
 
-    # TODO navigate all includes.
-    # make sure it doesn't have cycles.
-    def _construct(self):
+    @staticmethod
+    def _read_home():
         snixConf = os.path.join(os.environ["HOME"],".snix","snix.conf")
-        with open(self._file, 'r') as candidate:
-            _data = json.load(candidate)
-            parser = ConfigParser.ConfigParser()
-            parser.read(snixConf)
-            snixHome = parser.get("config", "snix.home")
-        if 'includes' in _data:
-            self._collect_includes(_data,snixHome)
-        if 'items' in _data:
-            map(lambda i:self._manifest_items.append(i), _data['items'])
-        if 'repos' in _data:
-            map(lambda i:self._manifest_repos.append(i), _data['repos'])
-        if 'customScripts' in _data:
-            map(lambda i:self._manifest_custom_scripts.append(i), _data['customScripts'])
-
-
-    def _collect_includes(self, _data,_snixHome):
-        
-        for include in _data['includes']:
-            _repo = include['upstreamRepo']
-            _dir = _repo.split('/')[-1].split('.')[0]
-            if not os.path.exists(_dir):
-                includeContext={}
-                includeContext['snix_root']= _snixHome
-                includeContext['repo_location']= _repo
-                Repo(includeContext).clone()
-            grp_dir = include['pathRelativeToGroupManifestDir']
-            _include_file = os.path.join(_snixHome, _dir, grp_dir,grp_dir+'.snix')
-        self._collect_from_file(_include_file,_snixHome)
-
-    def _collect_from_file(self, _include_file, _snixHome):
-        with open(_include_file, 'r') as candidate:
-            _data = json.load(candidate)
-        if 'include' in _data:
-            self._collect_includes(_data, _snixHome)
-        if 'items' in _data:
-            map(lambda i:self._manifest_items.append(i), _data['items'])
-        if 'repos' in _data:
-            map(lambda i:self._manifest_repos.append(i), _data['repos'])
-        if 'customScripts' in _data:
-            map(lambda i:self._manifest_custom_scripts.append(i), _data['customScripts'])
+        parser = ConfigParser.ConfigParser()
+        parser.read(snixConf)
+        return parser.get("config", "snix.home")
+
+    def _construct(self, use_cache=True, offline=False, stream=False, update_includes=False):
+        snixHome = self._read_home()
+        self._snix_home = snixHome
+        cache = ManifestCache(snixHome)
+        # Updating the includes means walking them, so the cached manifest is only written, not read.
+        if use_cache and not (update_includes and not offline):
+            cached = cache.load(self._file)
+            if cached is not None:
+                self._load(cached)
+                return
+        self._inputs = [self._file, SCHEMA_FILE]
+        # Includes an offline run read from a mirror or left out aren't files the cache can track. The parsed files
+        # aren't kept around once they're collected into records.
+        if self._collect(load_json(self._file, stream), snixHome, offline, stream, update_includes):
+            cache.store(self._file, self._inputs, self.to_records())
+
+    def select(self, **selectors):
+        """Narrows the manifest to the entries matching the selectors of ManifestIndex.select. Everything else is
+        left out of what gets planned and run."""
+        records = ManifestIndex(self._records()).select(**selectors)
+        for index in (self._manifest_items, self._manifest_repos, self._manifest_custom_scripts,
+                      self._manifest_downloads):
+            index.clear()
+        self._add(records)
+        self._selected = True
+        logger.info("Selected {0} items, {1} repos, {2} scripts and {3} downloads.".format(
+            *[len(records[section]) for section in ('items', 'repos', 'customScripts', 'downloads')]))
+
+    def is_selection(self):
+        """Whether only part of the manifest was selected, so dependencies may be outside of it."""
+        return self._selected
+
+    def _load(self, records):
+        """Fills the context from to_records()."""
+        self._add({'items': [ItemRecord.from_json(item) for item in records['items']],
+                   'repos': [RepoRecord.from_json(repo) for repo in records['repos']],
+                   'customScripts': [ScriptRecord.from_json(script) for script in records['customScripts']],
+                   'downloads': [DownloadRecord.from_json(download) for download in records['downloads']]})
+
+    def _add(self, records):
+        for item in records['items']:
+            self._manifest_items[self._item_key(item)] = item
+        for repo in records['repos']:
+            self._manifest_repos[normalize_url(repo.key)] = repo
+        for script in records['customScripts']:
+            self._manifest_custom_scripts[script.key] = script
+        for download in records['downloads']:
+            self._manifest_downloads[download.key] = download
+
+    def _records(self):
+        return {'items': self._manifest_items.values(), 'repos': self._manifest_repos.values(),
+                'customScripts': self._manifest_custom_scripts.values(),
+                'downloads': self._manifest_downloads.values()}
+
+    def to_records(self):
+        """The merged manifest, i.e. this file and everything it includes, as plain lists of entries."""
+        return dict((section, [record.to_json() for record in records])
+                    for section, records in self._records().items())
+
+    def _check_collisions(self):
+        """Aborts if two repos would be cloned into the same directory or two downloads saved as the same file.
+        Their actions would have the same id and one of them would never run."""
+        clones, saves = OrderedDict(), OrderedDict()
+        for record in self._manifest_repos.values():
+            clones.setdefault(dir_name(record.key), []).append(record)
+        for record in self._manifest_downloads.values():
+            saves.setdefault(file_name(record.key, record.entry.get('name')), []).append(record)
+        errors = []
+        for verb, by_name in (('cloned into', clones), ('saved as', saves)):
+            for name, records in by_name.items():
+                if len(records) > 1:
+                    errors.append("{0} are all {1} {2}".format(
+                        ', '.join("{0} (from {1})".format(record.key, record.source) for record in records), verb, name))
+        if errors:
+            snixCore.abort("The manifest has {0} collision(s). Give the downloads distinct names and make sure repo "
+                           "directories differ:\n{1}".format(len(errors), '\n'.join(errors)))
+
+    @staticmethod
+    def _item_key(item):
+        return item.via, InstalledIndex.normalize(item.via, item.name)
+
+    def _collect(self, _data, snixHome, offline=False, stream=False, update_includes=False):
+        resolver = IncludeResolver(snixHome, self._jobs, ManifestValidator.get(), offline, stream, update_includes)
+        with tracer.span('resolve includes'):
+            resolved = resolver.resolve(self._file, _data)
+        # Includes come first and the root manifest last, so an entry defined closer to the root wins.
+        for source, _, _manifest in resolved:
+            for item in _manifest.get('items', []):
+                for name in item['names']:
+                    record = ItemRecord(name, item['via'], source, item.get('tags'))
+                    self._merge(self._manifest_items, self._item_key(record), record)
+            for repo in _manifest.get('repos', []):
+                url = repo['url'] if type(repo) is dict else repo
+                self._merge(self._manifest_repos, normalize_url(url), RepoRecord(url, repo, source))
+            for script in _manifest.get('customScripts', []):
+                path = script['path'] if type(script) is dict else script
+                self._merge(self._manifest_custom_scripts, path, ScriptRecord(path, script, source))
+            for download in _manifest.get('downloads', []):
+                self._merge(self._manifest_downloads, download['url'], DownloadRecord(download['url'], download, source))
+        self._inputs.extend(resolver.files())
+        self._unresolved = resolver.unresolved()
+        if self._duplicates:
+            logger.info("Collapsed {0} duplicate entries:".format(len(self._duplicates)))
+            for key, sources in self._duplicates.items():
+                logger.info("  {0} from {1}. Using {2}.".format(
+                    key if type(key) is not tuple else "{1} via {0}".format(*key), ', '.join(sources), sources[-1]))
+        return resolver.complete()
+
+    def _merge(self, index, key, record):
+        if key in index:
+            sources = self._duplicates.setdefault(key, [index[key].source])
+            sources.append(record.source)
+        index[key] = record
+
+    def get_unresolved(self):
+        """Includes that were left out because they couldn't be read offline."""
+        return self._unresolved
+
+    def get_sources(self):
+        """The manifests the entries came from: root for this file and <repo>/<path> for each include."""
+        return set(record.source for records in self._records().values() for record in records)
+
+    def get_snix_home(self):
+        return self._snix_home
+
+    def get_manifest_file(self):
+        return self._file
+
+    def get_duplicates(self):
+        """Entries that were defined more than once, with the sources that defined them in order of precedence."""
+        return self._duplicates
 
     def __str__(self):
-        items = [''.join("{0} via {1}".format(item['names'], item['via'])) for item in iter(self._manifest_items)]
+        items = ["{0} via {1}".format(item.name, item.via) for item in self._manifest_items.values()]
         return '\n'.join(["\nItems to install: {0}".format(items),
-                          "Repositories to clone:{0}".format(json.dumps(self._manifest_repos, indent=2)),
-                          "Custom scripts to execute:{0}".format(json.dumps(self._manifest_custom_scripts, indent=2))])
+                          "Repositories to clone:{0}".format(json.dumps(
+                              [repo.entry for repo in self._manifest_repos.values()], indent=2)),
+                          "Files to download:{0}".format(json.dumps(
+                              [download.entry for download in self._manifest_downloads.values()], indent=2)),
+                          "Custom scripts to execute:{0}".format(json.dumps(
+                              [script.entry for script in self._manifest_custom_scripts.values()], indent=2))])
 
-    # TODO: make this take in a filter.
     def get_items(self):
-        def _build_item(name, via):
-            item_context = {'name': name, 'via': via}
-            return Item(item_context)
+        for item in self._manifest_items.values():
+            yield Item({'name': item.name, 'via': item.via, 'snix_root': self._snix_home})
 
-        all_items = []
-        for item in self._manifest_items:
-            for name in item['names']:
-                all_items.append(_build_item(name, item['via']))
-        return all_items
+    def get_item_batches(self, batch_size, installed=None):
+        """Groups the items by `via` so each backend can install up to batch_size of them with one command, or one
+        at a time for backends that can't batch. Items that the installed index already has are left out."""
+        names_by_via = OrderedDict()
+        for item in self._manifest_items.values():
+            names = names_by_via.setdefault(item.via, [])
+            if installed and installed.is_installed(item.via, item.name):
+                logger.info("Skipping {0} via {1}. Version {2} is already installed.".format(
+                    item.name, item.via, installed.version(item.via, item.name)))
+                continue
+            names.append(item.name)
+
+        all_batches = []
+        for via, names in names_by_via.items():
+            size = max(1, batch_size) if backends.get(via).batches else 1
+            for start in range(0, len(names), size):
+                batch_context = {'via': via, 'names': names[start:start + size], 'batch': start // size,
+                                 'snix_root': self._snix_home}
+                all_batches.append(ItemBatch(batch_context))
+        return all_batches
+
+    def get_vias(self):
+        return list(OrderedDict.fromkeys(item.via for item in self._manifest_items.values()))
 
     def get_repos(self):
-        all_repos=[]
-        for repo in self._manifest_repos:
-            repo_context = {'repo_location': repo}
-            all_repos.append(Repo(repo_context))
-        return all_repos
+        for repo in self._manifest_repos.values():
+            repo = repo.entry
+            if type(repo) is dict:
+                repo_context = {'repo_location': repo['url'], 'clone_options': repo}
+            else:
+                repo_context = {'repo_location': repo}
+            repo_context['snix_root'] = self._snix_home
+            yield Repo(repo_context)
 
     def get_custom_scripts(self):
-        all_scripts=[]
-        for script in self._manifest_custom_scripts:
-            custom_script_context = {'script_location': script}
-            all_scripts.append(Script(custom_script_context))
-        return all_scripts
-
+        for script in self._manifest_custom_scripts.values():
+            script = script.entry
+            if type(script) is dict:
+                custom_script_context = {'script_location': script['path'],
+                                         'depends_on': script.get('dependsOn', []),
+                                         'env': script.get('env', {})}
+                if 'umask' in script:
+                    custom_script_context['umask'] = int(script['umask'], 8)
+                if 'inputs' in script:
+                    custom_script_context['inputs'] = script['inputs']
+                    custom_script_context['outputs'] = script.get('outputs', [])
+            else:
+                custom_script_context = {'script_location': script}
+            custom_script_context['snix_root'] = self._snix_home
+            yield Script(custom_script_context)
 
+    def get_downloads(self):
+        for download in self._manifest_downloads.values():
+            download = download.entry
+            download_context = {'url': download['url'], 'sha256': download.get('sha256'), 'name': download.get('name'),
+                                'extract_to': download.get('extractTo'), 'jobs': self._jobs,
+                                'download_dir': os.path.join(self._snix_home, 'downloads')}
+            yield Download(download_context)
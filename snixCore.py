@@ -1,15 +1,15 @@
 #!/usr/bin/env python
-import urllib2
 import os
-import zipfile
-import subprocess
 
 import sys
+import threading
 from snixLogger import SnixLogger
-from contextlib import contextmanager
 
 logger = SnixLogger.logger()
 
+# The name of the task the current thread is working on. Used to label command output.
+current_task = threading.local()
+
 
 def abort(msg):
     logger.error(" -Aborting!- %s" % msg)
@@ -25,83 +25,129 @@ def create_dir(path):
         logger.info("%s already exists." % dir)
 
 
-def execute(cmd, use_shell):
-    # p = subprocess.Popen(cmd, shell=use_shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    #
-    # print("...")
-    # out, err = p.communicate()
-    # if out:
-    #     print(out)
-    # if err:
-    #     print(err)
-    # return p.poll()
+class ExecutionContext:
+    """Where and how a command runs: its working directory, environment variables laid over snix's own environment
+    and the umask of the child. It is handed to each subprocess rather than applied to the snix process, so commands
+    running at the same time can't see each other's directory or environment. Pass the command through command() and
+    the rest through popen_args()."""
+
+    def __init__(self, cwd=None, env=None, umask=None):
+        self.cwd = cwd
+        self.env = env or {}
+        self.umask = umask
+
+    def popen_args(self):
+        args = {'cwd': self.cwd}
+        if self.env:
+            env = dict(os.environ)
+            env.update(self.env)
+            args['env'] = env
+        return args
+
+    def command(self, cmd, use_shell):
+        """Returns cmd and use_shell for Popen. A umask is set by a shell in front of the command. Setting it in a
+        preexec_fn isn't safe while other threads are running, which they are with --jobs."""
+        if self.umask is None:
+            return cmd, use_shell
+        umask = 'umask {0:03o}; '.format(self.umask)
+        if use_shell:
+            # A list run by a shell is the script followed by its positional parameters.
+            return ([umask + cmd[0]] + cmd[1:], True) if type(cmd) is list else (umask + cmd, True)
+        return ['/bin/sh', '-c', umask + 'exec "$0" "$@"'] + (cmd if type(cmd) is list else [cmd]), False
+
+    def __str__(self):
+        return self.cwd or os.getcwd()
+
+
+def execute(cmd, use_shell, context=None, interactive=False, timeout=None):
+    """Runs a command and returns its status code.
+    Output is streamed through the OutputMultiplexer with each line prefixed by the current task's name, so commands
+    running on different threads don't garble each other. Interactive commands keep the terminal instead.
+    A command still running after timeout seconds is killed."""
+    from tracing import tracer
     msg = "Execute..."
-    logger.info(msg + "` {0} ` in {1}".format(' '.join(cmd) if type(cmd) is list else cmd, os.getcwd()))
-    try:
-        subprocess.check_call(cmd, stdin=None,shell=use_shell)
-        ret = 0
-    except subprocess.CalledProcessError as e:
-        logger.warn("{0} exited with error code {1}".format(e.cmd, str(e.returncode)))
-        ret = e.returncode
-
+    context = context or ExecutionContext()
+    command = ' '.join(cmd) if type(cmd) is list else cmd
+    logger.info(msg + "` {0} ` in {1}".format(command, context))
+    with tracer.span(command, cwd=str(context)) as span:
+        ret = _execute(cmd, use_shell, context, interactive, timeout)
+        span.set(exit_code=ret)
     logger.info(msg+"StatusCode:{0}...Done!".format(ret))
     return ret
-    # while p.poll() is None:
-    #     out = p.stdout.read(1)
-    #     err = p.stderr.read(1)
-    #     if not out:
-    #         # print("hello")
-    #         sys.stdout.write(out)
-    #         sys.stdout.flush()
-    #     if not err:
-    #         sys.stdout.write(err)
-    #         sys.stdout.flush()
-
-    # while True:
-    #     output = p.stdout.readline()
-    #     if output == '' and p.poll() is not None:
-    #         break
-    #     else:
-    #         sys.stdout.write(output)
-    #         sys.stdout.flush()
-
-
-@contextmanager
-def execute_in_dir_and_revert(target_dir):
-    original_dir = os.getcwd()
-    try:
-        logger.info("Switching to directory...{0}".format(target_dir))
-        os.chdir(target_dir)
-        yield
-    finally:
-        logger.info("Reverting back to directory...{0}".format(original_dir))
-        os.chdir(original_dir)
+
+
+def _execute(cmd, use_shell, context, interactive, timeout):
+    import subprocess
+    from multiplexer import OutputMultiplexer, EXIT_GRACE
+    args, shell = context.command(cmd, use_shell)
+    if interactive:
+        ret = subprocess.call(args, stdin=None, shell=shell, **context.popen_args())
+    else:
+        try:
+            p = subprocess.Popen(args, stdin=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell,
+                                 **context.popen_args())
+        except OSError as e:
+            logger.warn("Could not run {0}: {1}".format(cmd, e))
+            return 127
+        name = getattr(current_task, 'name', None) or os.path.basename(cmd[0] if type(cmd) is list else cmd.split()[0])
+        mux = OutputMultiplexer.get()
+        channel = mux.watch(name, p)
+
+        def _kill():
+            logger.warn("{0} timed out after {1}s".format(cmd, timeout))
+            p.kill()
+            mux.detach(channel)
+        timer = threading.Timer(timeout, _kill) if timeout else None
+        if timer:
+            timer.start()
+        while not channel.closed.wait(0.1):
+            if p.poll() is not None and not channel.closed.wait(EXIT_GRACE):
+                # The command exited but something it started in the background still holds the pipes.
+                mux.detach(channel)
+        p.stdout.close()
+        p.stderr.close()
+        ret = p.wait()
+        if timer:
+            timer.cancel()
+        if ret:
+            logger.warn("{0} exited with error code {1}. Last lines of output:\n{2}".format(
+                cmd, str(ret), '\n'.join(channel.tail)))
+    return ret
+
+
+def execute_and_capture(cmd, context=None):
+    """Runs a command and returns its status code and stdout. stderr is left alone."""
+    import subprocess
+    from tracing import tracer
+    command = ' '.join(cmd) if type(cmd) is list else cmd
+    logger.debug("Capture...` {0} `".format(command))
+    context = context or ExecutionContext()
+    args, shell = context.command(cmd, False)
+    with tracer.span(command) as span:
+        try:
+            p = subprocess.Popen(args, stdin=None, stdout=subprocess.PIPE, shell=shell, **context.popen_args())
+        except OSError as e:
+            logger.warn("Could not run {0}: {1}".format(cmd, e))
+            span.set(exit_code=127)
+            return 127, ''
+        out, _ = p.communicate()
+        span.set(exit_code=p.returncode, output_bytes=len(out))
+    return p.returncode, out
 
 
 # TODO validate url and destination. Might be a good method to start unit testing
-def downloadFile(url, targetDir):
+def downloadFile(url, targetDir, sha256=None):
     if not os.path.isdir(targetDir):
         raise ValueError("Will not download to a non existant directory:{}".format(targetDir))
     if not os.access(targetDir, os.W_OK):
         raise ValueError("Directory {} should be writable".format(targetDir))
+    import download
     fileName = os.path.basename(url)
-    file = os.path.join(targetDir, fileName)
-    if not os.path.exists(file):
-        res = urllib2.urlopen(url)
-        with open(file, "wb") as f:
-            f.write(res.read())
-        f.close()
-    return file
+    return download.fetch(url, os.path.join(targetDir, fileName), sha256)
 
 
 def extractIfCompressed(filePath, subDir):
     if not os.path.exists(filePath):
         raise ValueError("Cannot extract a non-existant file:{}".format(filePath))
-    extractedLocation = os.path.join(os.path.dirname(filePath), subDir)
-    if zipfile.is_zipfile(filePath):
-        zf = zipfile.ZipFile(filePath)
-        zf.extractall(extractedLocation)
-        zf.close()
-    else:
-        raise ValueError("{} is not a valid compressed file.".format(filePath))
-    return extractedLocation
+    import extract
+    return extract.extract(filePath, os.path.join(os.path.dirname(filePath), subDir))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import BaseHTTPServer
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import download
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the server's data with a strong ETag and honours Range and If-Range the way a real server does."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = self.server.data
+        etag = '"{0}"'.format(hashlib.md5(data).hexdigest())
+        self.server.requests.append(dict(self.headers))
+        match = re.match(r'bytes=(\d+)-$', self.headers.getheader('Range') or '')
+        if_range = self.headers.getheader('If-Range')
+        if match and if_range and if_range != etag:
+            match = None
+        start = int(match.group(1)) if match else 0
+        if match and start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if match else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+class FetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.target = os.path.join(self.tmp, 'downloads', 'file.bin')
+        self.partial = self.target + download.PARTIAL_SUFFIX
+        self.validator = self.partial + download.VALIDATOR_SUFFIX
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.data = b''.join(chr(i % 251) for i in range(300000))
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}/file.bin'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _leave_partial(self, data, validator):
+        os.makedirs(os.path.dirname(self.target))
+        with open(self.partial, 'wb') as f:
+            f.write(data)
+        with open(self.validator, 'w') as f:
+            f.write(validator + '\n')
+
+    def _etag(self, data):
+        return '"{0}"'.format(hashlib.md5(data).hexdigest())
+
+    def test_a_full_fetch(self):
+        sha256 = hashlib.sha256(self.server.data).hexdigest()
+        self.assertEqual(download.fetch(self.url, self.target, sha256), self.target)
+        self.assertEqual(self._read(self.target), self.server.data)
+        self.assertFalse(os.path.exists(self.partial))
+        self.assertFalse(os.path.exists(self.validator))
+        self.assertNotIn('range', self.server.requests[0])
+
+    def test_a_complete_target_is_not_fetched_again(self):
+        download.fetch(self.url, self.target)
+        download.fetch(self.url, self.target, hashlib.sha256(self.server.data).hexdigest())
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_a_partial_is_resumed(self):
+        self._leave_partial(self.server.data[:100000], self._etag(self.server.data))
+        download.fetch(self.url, self.target, hashlib.sha256(self.server.data).hexdigest())
+        self.assertEqual(self._read(self.target), self.server.data)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.server.requests[0]['range'], 'bytes=100000-')
+        self.assertEqual(self.server.requests[0]['if-range'], self._etag(self.server.data))
+        self.assertFalse(os.path.exists(self.validator))
+
+    def test_a_partial_of_a_file_that_changed_is_started_over(self):
+        old = b'x' * 100000
+        self._leave_partial(old, self._etag(old + b'y' * 200000))
+        download.fetch(self.url, self.target)
+        self.assertEqual(self._read(self.target), self.server.data)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertIn('range', self.server.requests[0])
+
+    def test_a_partial_without_a_validator_is_started_over(self):
+        os.makedirs(os.path.dirname(self.target))
+        with open(self.partial, 'wb') as f:
+            f.write(b'x' * 100000)
+        download.fetch(self.url, self.target)
+        self.assertEqual(self._read(self.target), self.server.data)
+        self.assertNotIn('range', self.server.requests[0])
+
+    def test_a_complete_partial_answered_with_416_is_started_over(self):
+        self._leave_partial(self.server.data, self._etag(self.server.data))
+        download.fetch(self.url, self.target)
+        self.assertEqual(self._read(self.target), self.server.data)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0]['range'], 'bytes=300000-')
+        self.assertNotIn('range', self.server.requests[1])
+        self.assertFalse(os.path.exists(self.validator))
+
+    def test_a_sha256_mismatch_leaves_nothing_behind(self):
+        self.assertRaises(ValueError, download.fetch, self.url, self.target, '0' * 64)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.partial))
+        self.assertFalse(os.path.exists(self.validator))
+
+    def test_a_resumed_sha256_mismatch_leaves_nothing_behind(self):
+        self._leave_partial(b'x' * 100000, self._etag(self.server.data))
+        self.assertRaises(ValueError, download.fetch, self.url, self.target,
+                          hashlib.sha256(self.server.data).hexdigest())
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.partial))
+        self.assertFalse(os.path.exists(self.validator))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import unittest
+
+from engine import Call, Engine, Return, Spawn, drive, nested
+
+
+def _add(a, b):
+    return a + b
+
+
+def _fail():
+    raise ValueError('broken')
+
+
+class NestedTest(unittest.TestCase):
+
+    def _run(self, coroutine, replies=()):
+        """Drives nested(coroutine) by hand and returns (requests seen, result)."""
+        driver = nested(coroutine)
+        replies = list(replies)
+        requests = []
+        value = None
+        try:
+            while True:
+                requests.append(driver.send(value))
+                value = replies.pop(0)
+        except Return as r:
+            return requests, r.value
+        except StopIteration:
+            return requests, None
+
+    def test_nested_coroutine_result_is_sent_back(self):
+        def inner():
+            status = yield Spawn(['true'])
+            raise Return(status + 10)
+
+        def outer():
+            value = yield inner()
+            raise Return(value * 2)
+        requests, result = self._run(outer(), [1])
+        self.assertEqual([str(request) for request in requests], ['true'])
+        self.assertEqual(result, 22)
+
+    def test_coroutine_without_return_resumes_with_none(self):
+        def inner():
+            yield Spawn(['true'])
+
+        def outer():
+            value = yield inner()
+            raise Return(value)
+        self.assertEqual(self._run(outer(), [0])[1], None)
+
+    def test_exception_propagates_to_the_caller(self):
+        def inner():
+            yield Spawn(['true'])
+            raise ValueError('inner failed')
+
+        def outer():
+            try:
+                yield inner()
+            except ValueError as e:
+                raise Return(str(e))
+        self.assertEqual(self._run(outer(), [0])[1], 'inner failed')
+
+    def test_several_levels(self):
+        def level(depth):
+            if depth == 0:
+                value = yield Spawn(['true'])
+                raise Return(value)
+            value = yield level(depth - 1)
+            raise Return(value + 1)
+        self.assertEqual(self._run(level(5), [0])[1], 5)
+
+    def test_closing_closes_every_level(self):
+        closed = []
+
+        def inner():
+            try:
+                yield Spawn(['true'])
+            finally:
+                closed.append('inner')
+
+        def outer():
+            try:
+                yield inner()
+            finally:
+                closed.append('outer')
+        driver = nested(outer())
+        next(driver)
+        driver.close()
+        self.assertEqual(closed, ['inner', 'outer'])
+
+
+class DriveTest(unittest.TestCase):
+
+    def test_calls_and_nested_coroutines(self):
+        def inner():
+            value = yield Call(_add, 1, 2)
+            raise Return(value)
+
+        def outer():
+            value = yield inner()
+            try:
+                yield Call(_fail)
+            except ValueError:
+                raise Return(value)
+        self.assertEqual(drive(outer()), 3)
+
+    def test_engine_runs_nested_spawns(self):
+        def inner(code):
+            status = yield Spawn(['sh', '-c', 'exit {0}'.format(code)])
+            raise Return(status)
+
+        def outer(code):
+            status = yield inner(code)
+            raise Return(status)
+        self.assertEqual(Engine().run([outer(0), outer(3)]), [0, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
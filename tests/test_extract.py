@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import extract
+
+
+class SafePathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.target = os.path.join(tempfile.gettempdir(), 'snix-target')
+
+    def test_members_go_under_the_target(self):
+        self.assertEqual(extract._safe_path(self.target, 'a/b.txt'), os.path.join(self.target, 'a', 'b.txt'))
+        self.assertEqual(extract._safe_path(self.target, './a/../b'), os.path.join(self.target, 'b'))
+
+    def test_the_root_entry_is_the_target(self):
+        self.assertEqual(extract._safe_path(self.target, '.'), self.target)
+        self.assertEqual(extract._safe_path(self.target + '/', './'), self.target)
+
+    def test_members_outside_the_target_are_refused(self):
+        for name in ('../x', 'a/../../x', '/etc/passwd', '..'):
+            self.assertRaises(ValueError, extract._safe_path, self.target, name)
+
+    def test_a_sibling_with_the_same_prefix_is_refused(self):
+        self.assertRaises(ValueError, extract._safe_path, self.target, '../snix-target-other/x')
+
+
+class ExtractTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, 'source')
+        os.makedirs(os.path.join(self.source, 'bin'))
+        with open(os.path.join(self.source, 'bin', 'tool'), 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(os.path.join(self.source, 'bin', 'tool'), 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _tar(self, arcname):
+        archive = os.path.join(self.tmp, 'archive.tar.gz')
+        with tarfile.open(archive, 'w:gz') as tar:
+            tar.add(self.source, arcname)
+        return archive
+
+    def test_tar_made_from_its_directory(self):
+        # What `tar -C source .` produces: a ./ entry followed by ./bin and ./bin/tool.
+        target = extract.extract(self._tar('.'), os.path.join(self.tmp, 'out'))
+        tool = os.path.join(target, 'bin', 'tool')
+        self.assertTrue(os.path.isfile(tool))
+        self.assertEqual(os.stat(tool).st_mode & 0o777, 0o755)
+
+    def test_tar_escaping_the_target_is_refused(self):
+        self.assertRaises(ValueError, extract.extract, self._tar('../escaped'), os.path.join(self.tmp, 'out'))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'escaped')))
+
+    def _links_out(self, archive, members):
+        with tarfile.open(archive, 'w') as tar:
+            for name, kind, linkname in members:
+                info = tarfile.TarInfo(name)
+                info.type = kind
+                info.linkname = linkname or ''
+                data = b'escaped\n' if kind == tarfile.REGTYPE else b''
+                info.size = len(data)
+                info.mode = 0o755 if kind == tarfile.DIRTYPE else 0o644
+                tar.addfile(info, io.BytesIO(data))
+        return archive
+
+    def test_chained_symlinks_escaping_the_target_are_refused(self):
+        # Every name stays inside the target, but a -> . makes a/b/up -> ../.. point at the target's parent.
+        archive = self._links_out(os.path.join(self.tmp, 'chain.tar'), [
+            ('a', tarfile.SYMTYPE, '.'),
+            ('b', tarfile.DIRTYPE, None),
+            ('a/b/up', tarfile.SYMTYPE, '../..'),
+            ('a/b/up/ESCAPED', tarfile.REGTYPE, None)])
+        target = os.path.join(self.tmp, 'nested', 'out')
+        self.assertRaises(ValueError, extract.extract, archive, target)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'nested', 'ESCAPED')))
+        self.assertFalse(os.path.lexists(os.path.join(target, 'b', 'up')))
+
+    def test_symlinks_inside_the_target_are_kept(self):
+        archive = self._links_out(os.path.join(self.tmp, 'links.tar'), [
+            ('bin', tarfile.DIRTYPE, None),
+            ('bin/tool', tarfile.REGTYPE, None),
+            ('current', tarfile.SYMTYPE, 'bin'),
+            ('bin/alias', tarfile.SYMTYPE, 'tool'),
+            ('current/other', tarfile.REGTYPE, None)])
+        target = extract.extract(archive, os.path.join(self.tmp, 'out'))
+        self.assertEqual(os.readlink(os.path.join(target, 'current')), 'bin')
+        self.assertTrue(os.path.isfile(os.path.join(target, 'bin', 'alias')))
+        self.assertTrue(os.path.isfile(os.path.join(target, 'bin', 'other')))
+
+    def test_a_link_leaving_the_target_is_refused(self):
+        archive = self._links_out(os.path.join(self.tmp, 'out.tar'), [
+            ('dir', tarfile.DIRTYPE, None),
+            ('dir/link', tarfile.SYMTYPE, '../../..')])
+        self.assertRaises(ValueError, extract.extract, archive, os.path.join(self.tmp, 'out'))
+
+    def test_zip_is_extracted_once(self):
+        archive = os.path.join(self.tmp, 'archive.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.write(os.path.join(self.source, 'bin', 'tool'), 'bin/tool')
+        target = os.path.join(self.tmp, 'out')
+        extract.extract(archive, target)
+        with open(os.path.join(target, 'bin', 'tool'), 'w') as f:
+            f.write('edited')
+        extract.extract(archive, target)
+        # The members are still there, so the second extraction is skipped.
+        with open(os.path.join(target, 'bin', 'tool'), 'r') as f:
+            self.assertEqual(f.read(), 'edited')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+import unittest
+
+from item import InstalledIndex
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def test_package_names_drop_the_tap_and_case(self):
+        self.assertEqual(InstalledIndex.normalize('brew', 'homebrew/versions/Foo'), 'foo')
+        self.assertEqual(InstalledIndex.normalize('apt', 'LibSSL-dev'), 'libssl-dev')
+
+    def test_urls_are_kept_as_they_are(self):
+        # Two URLs ending in the same file name are different items.
+        first = InstalledIndex.normalize('url', 'https://a.example.com/v1/Setup.pkg')
+        second = InstalledIndex.normalize('url', 'https://b.example.com/other/setup.pkg')
+        self.assertEqual(first, 'https://a.example.com/v1/Setup.pkg')
+        self.assertNotEqual(first, second)
+
+    def test_installed_lookup_uses_the_backend_of_the_item(self):
+        index = InstalledIndex.from_snapshot({'brew': {'foo': '1.0'},
+                                              'url': {'https://a.example.com/v1/Setup.pkg': 'url'}})
+        self.assertEqual(index.version('brew', 'homebrew/versions/foo'), '1.0')
+        self.assertTrue(index.is_installed('url', 'https://a.example.com/v1/Setup.pkg'))
+        self.assertFalse(index.is_installed('url', 'https://b.example.com/other/setup.pkg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+import unittest
+
+from repo import dir_name, host_of, normalize_url
+
+
+class NormalizeUrlTest(unittest.TestCase):
+
+    def test_spellings_of_one_repo_share_a_key(self):
+        spellings = ['git@github.com:org/x.git', 'https://github.com/org/x', 'https://github.com/org/x.git/',
+                     'ssh://git@GitHub.com/org/x.git', 'https://user@github.com/org/x', 'git://github.com/org/x']
+        self.assertEqual(set(map(normalize_url, spellings)), set(['github.com/org/x']))
+
+    def test_port_is_dropped_and_path_case_kept(self):
+        self.assertEqual(normalize_url('ssh://git@host.example.com:2222/Org/X.git'), 'host.example.com/Org/X')
+
+    def test_local_paths(self):
+        self.assertEqual(normalize_url('/srv/git/x.git'), '/srv/git/x')
+        self.assertEqual(normalize_url('file:///srv/git/x.git'), '/srv/git/x')
+
+    def test_different_repos_differ(self):
+        self.assertNotEqual(normalize_url('github.com/a/utils'), normalize_url('github.com/b/utils'))
+
+
+class RepoNamesTest(unittest.TestCase):
+
+    def test_dir_name(self):
+        self.assertEqual(dir_name('git@github.com:org/x.git'), 'x')
+        self.assertEqual(dir_name('https://github.com/org/x/'), 'x')
+        self.assertEqual(dir_name('/srv/git/x.git'), 'x')
+
+    def test_host_of(self):
+        self.assertEqual(host_of('git@github.com:org/x.git'), 'github.com')
+        self.assertEqual(host_of('https://GitHub.com/org/x'), 'github.com')
+        self.assertEqual(host_of('/srv/git/x.git'), 'localhost')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import threading
+import time
+import unittest
+
+from scheduler import Scheduler, Task, SUCCEEDED, FAILED, SKIPPED
+
+
+class Recorder:
+    """Actions that record the order they ran in and how many ran at the same time."""
+
+    def __init__(self):
+        self.order = []
+        self.running = 0
+        self.most = 0
+        self._lock = threading.Lock()
+
+    def action(self, name, ret=0, seconds=0):
+        def _run():
+            with self._lock:
+                self.running += 1
+                self.most = max(self.most, self.running)
+            time.sleep(seconds)
+            with self._lock:
+                self.running -= 1
+                self.order.append(name)
+            return ret
+        return _run
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = Recorder()
+
+    def _task(self, name, depends_on=None, ret=0, seconds=0, lock=None):
+        return Task(name, self.recorder.action(name, ret, seconds), depends_on, lock=lock)
+
+    def test_dependencies_run_first(self):
+        scheduler = Scheduler(4)
+        scheduler.add(self._task('c', ['a', 'b']))
+        scheduler.add(self._task('a', seconds=0.05))
+        scheduler.add(self._task('b'))
+        results = scheduler.run()
+        self.assertEqual(self.recorder.order[-1], 'c')
+        self.assertEqual(set(results.values()), set([SUCCEEDED]))
+
+    def test_dependents_of_a_failure_are_skipped(self):
+        scheduler = Scheduler(2)
+        scheduler.add(self._task('a', ret=1))
+        scheduler.add(self._task('b', ['a']))
+        scheduler.add(self._task('c', ['b']))
+        scheduler.add(self._task('d'))
+        results = scheduler.run()
+        self.assertEqual(results, {'a': FAILED, 'b': SKIPPED, 'c': SKIPPED, 'd': SUCCEEDED})
+        self.assertEqual(sorted(self.recorder.order), ['a', 'd'])
+
+    def test_a_lock_runs_one_task_at_a_time(self):
+        scheduler = Scheduler(4)
+        for name in 'abcd':
+            scheduler.add(self._task(name, seconds=0.02, lock='brew'))
+        scheduler.run()
+        self.assertEqual(self.recorder.most, 1)
+
+    def test_a_limited_lock_runs_that_many_at_a_time(self):
+        scheduler = Scheduler(8)
+        for name in 'abcdefgh':
+            scheduler.add(self._task(name, seconds=0.05, lock='host:github.com'))
+        scheduler.limit('host:github.com', 3)
+        scheduler.run()
+        self.assertEqual(self.recorder.most, 3)
+
+    def test_jobs_bound_the_tasks_in_flight(self):
+        scheduler = Scheduler(2)
+        for name in 'abcde':
+            scheduler.add(self._task(name, seconds=0.02))
+        scheduler.run()
+        self.assertEqual(self.recorder.most, 2)
+
+    def test_duplicate_task_ids_abort(self):
+        scheduler = Scheduler()
+        scheduler.add(self._task('repo:utils'))
+        self.assertRaises(SystemExit, scheduler.add, self._task('repo:utils'))
+
+    def test_cycles_abort(self):
+        scheduler = Scheduler()
+        scheduler.add(self._task('a', ['b']))
+        scheduler.add(self._task('b', ['a']))
+        self.assertRaises(SystemExit, scheduler.ordered)
+
+    def test_resolve_accepts_bare_names_and_provided_items(self):
+        scheduler = Scheduler()
+        scheduler.add(self._task('repo:alpha'))
+        scheduler.add(Task('items:brew:0', lambda: 0, provides=['git', 'wget']))
+        self.assertEqual(scheduler.resolve('alpha'), 'repo:alpha')
+        self.assertEqual(scheduler.resolve('wget'), 'items:brew:0')
+        self.assertRaises(SystemExit, scheduler.resolve, 'missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import snixLogger
+from snixCore import current_task
+
+logger = snixLogger.SnixLogger.logger()
+
+
+class Span:
+    """A timed step of a run. Attributes can be added until it ends, e.g. the exit code of a command."""
+
+    def __init__(self, name, lane, parent, attrs):
+        self.name = name
+        self.lane = lane
+        self.parent = parent
+        self.attrs = attrs
+        self.start = time.time()
+        self.end = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def stack(self):
+        names = []
+        span = self
+        while span:
+            names.append(span.name)
+            span = span.parent
+        return ';'.join(reversed(names))
+
+
+class _NoSpan:
+    """Stands in for a Span when tracing is off, so call sites don't need to check."""
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _SpanContext:
+    def __init__(self, tracer, name, lane, attrs):
+        self._tracer = tracer
+        self._name = name
+        self._lane = lane
+        self._attrs = attrs
+        self._span = None
+
+    def __enter__(self):
+        self._span = self._tracer.begin(self._name, self._lane, **self._attrs)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self._span.set(error=str(exc) or exc_type.__name__)
+        self._tracer.end(self._span)
+        return False
+
+
+class Tracer:
+    """Collects spans for every step of a run.
+    Spans are kept per lane, which is the task the step belongs to, or the thread for steps outside a task. A span
+    begun while another is open on the same lane is its child. Nothing is recorded unless the tracer is enabled."""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._spans = []
+        self._open = {}
+        self._lanes = OrderedDict()
+
+    @staticmethod
+    def current_lane():
+        return getattr(current_task, 'name', None) or threading.current_thread().name
+
+    def span(self, name, lane=None, **attrs):
+        """Use as `with tracer.span('clone', command=cmd) as span:`."""
+        if not self.enabled:
+            return _NoSpan()
+        return _SpanContext(self, name, lane, attrs)
+
+    def begin(self, name, lane=None, **attrs):
+        if not self.enabled:
+            return _NoSpan()
+        lane = lane or self.current_lane()
+        with self._lock:
+            stack = self._open.setdefault(lane, [])
+            span = Span(name, lane, stack[-1] if stack else None, attrs)
+            stack.append(span)
+            self._lanes.setdefault(lane, len(self._lanes) + 1)
+        return span
+
+    def end(self, span, **attrs):
+        if not isinstance(span, Span):
+            return
+        span.set(**attrs)
+        span.end = time.time()
+        with self._lock:
+            stack = self._open.get(span.lane, [])
+            if span in stack:
+                stack.remove(span)
+            self._spans.append(span)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def export_chrome(self, path):
+        """Writes the spans as Chrome trace events, which chrome://tracing and Perfetto can open."""
+        spans = self.spans()
+        epoch = min(span.start for span in spans) if spans else 0
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': lane}}
+                  for lane, tid in self._lanes.items()]
+        for span in sorted(spans, key=lambda s: s.start):
+            events.append({'name': span.name, 'cat': span.name.split(':')[0], 'ph': 'X', 'pid': os.getpid(),
+                           'tid': self._lanes[span.lane], 'ts': int((span.start - epoch) * 1e6),
+                           'dur': int((span.end - span.start) * 1e6), 'args': span.attrs})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def export_folded(self, path):
+        """Writes the spans as folded stacks, one `parent;child microseconds` line per stack with the time spent in
+        the span itself, which is what flamegraph.pl and speedscope read."""
+        spans = self.spans()
+        children = {}
+        for span in spans:
+            if span.parent:
+                children[span.parent] = children.get(span.parent, 0) + (span.end - span.start)
+        folded = OrderedDict()
+        for span in spans:
+            own = max(0, (span.end - span.start) - children.get(span, 0))
+            folded[span.stack()] = folded.get(span.stack(), 0) + int(own * 1e6)
+        with open(path, 'w') as f:
+            for stack, micros in folded.items():
+                f.write("{0} {1}\n".format(stack, micros))
+
+    def export(self, path):
+        """Writes the Chrome trace to path and the folded stacks next to it."""
+        self.export_chrome(path)
+        folded = os.path.splitext(path)[0] + '.folded'
+        self.export_folded(folded)
+        logger.info("Wrote the trace to {0} and {1}".format(path, folded))
+
+
+tracer = Tracer()
+
+
+def traced(name, coroutine, **attrs):
+    """Wraps an action coroutine in a span on its own lane that lasts until the coroutine finishes."""
+    if not tracer.enabled:
+        return coroutine
+    return _traced(name, coroutine, attrs)
+
+
+def _traced(name, coroutine, attrs):
+    span = tracer.begin(name, name, **attrs)
+    value = error = None
+    try:
+        while True:
+            try:
+                request = coroutine.throw(*error) if error else coroutine.send(value)
+            except StopIteration:
+                return
+            error = None
+            try:
+                value = yield request
+            except GeneratorExit:
+                coroutine.close()
+                raise
+            except Exception:
+                error = sys.exc_info()
+    except Exception as e:
+        span.set(status=getattr(e, 'value', str(e)))
+        raise
+    finally:
+        tracer.end(span)
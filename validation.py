@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+import json
+import os
+
+import snixLogger
+
+logger = snixLogger.SnixLogger.logger()
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.json')
+
+
+def json_pointer(path):
+    """The JSON pointer (RFC 6901) for a path of keys and indexes, e.g. /items/0/via."""
+    return '/' + '/'.join(str(p).replace('~', '~0').replace('/', '~1') for p in path)
+
+
+class ManifestValidator:
+    """Validates manifests against schema.json.
+    The schema is loaded and checked once per process and the validator is reused for every file. Validation reports
+    every error in a file at once rather than stopping at the first one."""
+    instance = None
+
+    @staticmethod
+    def get():
+        if ManifestValidator.instance is None:
+            ManifestValidator.instance = ManifestValidator(SCHEMA_FILE)
+        return ManifestValidator.instance
+
+    def __init__(self, schema_file):
+        from jsonschema import Draft4Validator
+        with open(schema_file, 'r') as f:
+            schema = json.load(f)
+        Draft4Validator.check_schema(schema)
+        self._validator = Draft4Validator(schema)
+
+    def errors(self, data, manifest_file):
+        """Returns a list of `file:pointer: message` strings, empty if data is valid."""
+        found = sorted(self._validator.iter_errors(data), key=lambda e: list(e.absolute_path))
+        return ["{0}:{1}: {2}".format(manifest_file, json_pointer(e.absolute_path), e.message)
+                for e in map(self._most_relevant, found)]
+
+    def _most_relevant(self, error):
+        # oneOf errors only say that nothing matched. The alternative that got deepest into the data is most likely
+        # the one that was meant.
+        if error.context:
+            return self._most_relevant(max(error.context, key=lambda e: len(e.absolute_path)))
+        return error